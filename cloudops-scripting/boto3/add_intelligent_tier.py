@@ -1,115 +1,129 @@
-#Adds lifecycle rule to entire bucket but overwrites/deletes all exisitng lifecycle rules.
-#Options: Get exisitng lifecycle configurations for buckets and append to new rule. OR skip buckets with lifecycle rules
+#Adds the intelligent tiering lifecycle rule to entire buckets.
+#Options: skip buckets with other lifecycle rules (default) OR with --merge add the rule to their exisitng lifecycle configurations.
+#Buckets that already hold the rule are never written to, and are skipped without a call on later runs.
+#The buckets are listed with list_buckets, or read from <account>_bucketslist.csv with --bucket-csv, and every bucket is called in its own region.
+#With --profile the objects of each bucket are profiled first, and only buckets whose bytes are mostly in objects of 128 KB or more get the rule.
 
-import boto3
-import botocore
-import csv
-from datetime import datetime
-from dateutil.tz import tzlocal
+import argparse
+import contextlib
+from cloudops import metrics
+from cloudops.accounts import read_csv
+from cloudops.fanout import fan_out
+from cloudops.session import account_role_arn
+from cloudops import buckets, bucket_profile, lifecycle
+from cloudops.reports import open_report, add_rows, end_account, add_report_arguments
 
 accountCSV = 's3_accounts.csv'   #CSV with list of managed accounts.
-s3Bucket = '_bucketslist.csv'
+s3Bucket = '_bucketslist.csv'    #CSV with the buckets of an account, read with --bucket-csv.
 lcrCSV = '_intelligenttier.csv'
+lcrColumns = ['Account#', 'BucketName', 'LifecycleName', 'RuleApplied','OwnerID', 'Action']    #Column headings in csv files.
+profileCSV = '_bucket_profile.csv'
+profileColumns = ['Account#'] + bucket_profile.profileColumns      #Size and age histograms of the profiled buckets.
 lcName = 'MoveToIntelligentTiering'
+accountWorkers = 8                     #Number of accounts processed at the same time.
+bucketWorkers = 8                      #Number of buckets updated at the same time within an account.
+compliantActions = ('cached', 'unchanged')      #Actions of buckets that already hold the rule.
 
-def assumed_role_session(role_arn: str, base_session: botocore.session.Session = None):
-    base_session = base_session or boto3.session.Session()._session
-    fetcher = botocore.credentials.AssumeRoleCredentialFetcher(
-        client_creator = base_session.create_client,
-        source_credentials = base_session.get_credentials(),
-        role_arn = role_arn,
-        extra_args = {
-        #    'RoleSessionName': None # set this if you want something non-default
-        }
-    )
-    creds = botocore.credentials.DeferredRefreshableCredentials(
-        method = 'assume-role',
-        refresh_using = fetcher.fetch_credentials,
-        time_fetcher = lambda: datetime.now(tzlocal())
-    )
-    botocore_session = botocore.session.Session()
-    botocore_session._credentials = creds
-    return boto3.Session(botocore_session = botocore_session)
+#The lifecycle rule for intelligent tiering, applied to every object in the bucket.
+def tiering_rule():
+    return {
+        'ID': lcName,       #Name of the Lifecycle rule
+        'Prefix': '',                           #Empty prefix name to ensure the lifecycle rule applies to all objects in the bucket.
+        'Status': 'Disabled',                   #Enable or disable this rule
+        'Transitions': [
+            {
+                'Days': 0,                      #The number of days before the object is transitioned. 0 days = instantly/end of current day
+                'StorageClass': 'INTELLIGENT_TIERING'
+            },
+        ]
+    }
 
-#Reads a csv file of managed accounts and returns the account numbers in a list.
-def read_csv(pathName):
-    accountNum = []     #List to store account numbers.
-    lineCount = 0
-    with open(pathName, mode = 'r') as file:
-        accountsList = list(csv.reader(file))
-        for acct in accountsList:   #Reads the csv file with managed accounts and appends the account numbers to a list.
-            if lineCount == 0:
-                lineCount += 1
-                continue
-            accountNum.append(acct[0])
-    return accountNum
+#Returns the RuleApplied value of a bucket's csv row: True when the rule was written by this run, 'Already applied' when the bucket held it.
+def rule_applied(action):
+    return 'Already applied' if action in compliantActions else action in ('added', 'updated')
 
-#Checks to see if the bucket has exisiting lifecycle rules to avoid overwriting rules.
-def check_lifecycle(session, bucket): 
-    bucketClient = session.client('s3')
+#Adds the lifecycle rule for intelligent tiering to one bucket and returns its csv row, and its profile row when profile is set.
+#Buckets that already hold the rule or would be skipped are not written to, or profiled. A profiled bucket that is not eligible is left alone.
+def bucket_rule(accountNum, bucketName, merge, profile):
+    rule = tiering_rule()
+    profileData = None
     try:
-        response = bucketClient.get_bucket_lifecycle_configuration(
-            Bucket = bucket,
-        )
-        return True
-    except Exception as noLifecycle:
-        print(f"{noLifecycle} in the bucket {bucket}")
-        return False
+        s3Client = buckets.bucket_client(accountNum, bucketName)     #Pooled s3 client of the bucket's region.
+        action = None
+        if profile:         #Only buckets the rule would change are profiled, the configuration is read again before it is written.
+            action, current = lifecycle.check_rule(s3Client, accountNum, bucketName, rule, merge)
+        if action is None and profile:
+            histogram = bucket_profile.profile_bucket(s3Client, bucketName)
+            profileData = [accountNum] + bucket_profile.profile_row(bucketName, histogram)
+            eligible, reason = bucket_profile.eligibility(histogram)
+            if not eligible:
+                action = 'ineligible'
+                print(f"The bucket {bucketName} is not eligible for intelligent tiering ({reason}) and will be skipped!")
+        if action is None:
+            action = lifecycle.apply_rule(s3Client, accountNum, bucketName, rule, merge)
+    except Exception as ruleError:
+        print(f"An error has occurred with the lifecycle rule of the bucket {bucketName}: {ruleError}")
+        action = 'error'
+    if action in ('added', 'updated'):
+        print(f"Lifecycle rule was successfully {action} to {bucketName}!!!")
+    elif action == 'skipped':
+        print(f"The bucket {bucketName} has existing an lifecycle rule and will be skipped!")
+    return [accountNum, bucketName, lcName, rule_applied(action), 'owner', action], profileData
+
+#Adds the lifecycle rule for intelligent tiering to the buckets of an account, several buckets at a time.
+#With merge the rule is added to the existing rules of a bucket, otherwise buckets with other rules are skipped.
+#With a profileReport the buckets are profiled first and their profiles written to it.
+def bucket_lifecycle(prefixCsv,accountNum,report,merge,bucketCsv,profileReport=None):
+    try:
+        if bucketCsv:
+            bucketNames = read_csv(prefixCsv + s3Bucket)       #reads the list of buckets associated with an AWS account from a user-defined csv file.
+        else:
+            bucketNames = buckets.discover_buckets(accountNum)     #every bucket of the account, with its region.
+        for bucketName, result, bucketError in fan_out(bucketNames, lambda bucketName: bucket_rule(accountNum, bucketName, merge, profileReport is not None), bucketWorkers):    #Rows come back in bucket order.
+            if bucketError:         #A failure in one bucket does not stop the others.
+                print(f"An error has occurred with the lifecycle rule of the bucket {bucketName}: {bucketError}")
+                result = ([accountNum, bucketName, lcName, False, 'owner', 'error'], None)
+            lcrData, profileData = result
+            add_rows(report, accountNum, [lcrData])        #hands the data to the report, its writer thread writes it to the csv file.
+            if profileData:
+                add_rows(profileReport, accountNum, [profileData])
+    finally:
+        end_account(report, accountNum)
+        if profileReport is not None:
+            end_account(profileReport, accountNum)
+        lifecycle.save_cache()        #Buckets that hold the rule are skipped without a call by the next runs.
+        buckets.save_cache()          #Bucket regions are not looked up again.
 
-#Adds the lifecycle rule for intelligent tiering to the bucket.
-def bucket_lifecycle(session, prefixCsv,accountNum):
-    s3Client = session.client('s3')
-    pathName = prefixCsv + lcrCSV
-    bucketCSV = prefixCsv + s3Bucket
-    with open(pathName, mode = 'w', newline='')	as file:
-        header = ['Account#', 'BucketName', 'LifecycleName', 'RuleApplied','OwnerID']    #Column headings in csv files.
-        lcrIntelliTier = csv.writer(file, delimiter=',')
-        lcrIntelliTier.writerow(header)
-        buckets = read_csv(bucketCSV)       #reads the list of buckets associated with an AWS account from a user-defined csv file.
-        for bucketName in buckets:          #interates throught the buckets to apply the lifecycle rule.
-            existingLC = check_lifecycle(session, bucketName)
-            if not existingLC:              #If a bucket has no exisitng lifecycle rules add the new one, otherwise skip to the next bucket.
-                response = s3Client.put_bucket_lifecycle_configuration(
-                    Bucket = bucketName,
-                    LifecycleConfiguration = {
-                        'Rules': [
-                            {
-                                'ID': lcName,       #Name of the Lifecycle rule
-                                'Prefix': '',                           #Empty prefix name to ensure the lifecycle rule applies to all objects in the bucket.
-                                'Status': 'Disabled',                   #Enable or disable this rule
-                                'Transitions': [
-                                    {
-                                        'Days': 0,                      #The number of days before the object is transitioned. 0 days = instantly/end of current day
-                                        'StorageClass': 'INTELLIGENT_TIERING'
-                                    },
-                                ]
-                            },
-                        ]
-                    },
-                )
-                lcrData = [accountNum, bucketName, lcName, (not existingLC), 'owner']
-                lcrIntelliTier.writerow(lcrData)        #writes the data to a csv file.
-                print(f"Lifecycle rule was successfully added to {bucketName}!!!")
-            else:
-                lcrData = [accountNum, bucketName, lcName, (not existingLC), 'owner']
-                lcrIntelliTier.writerow(lcrData)        #writes the data to a csv file.
-                print(f"The bucket {bucketName} has existing an lifecycle rule and will be skipped!")
 
+#Assumes the role in one account and writes that account's part of the report.
+def process_account(account, report, merge, bucketCsv, profileReport = None):
+    print(account_role_arn(account))
+    prefix = str(account) #Helps to find the bucket csv file of each account.
+    bucket_lifecycle(prefix,account,report,merge,bucketCsv,profileReport)
 
-def main():
+def main(argv = None):
+    parser = add_report_arguments(argparse.ArgumentParser(description = 'Adds the intelligent tiering lifecycle rule to the buckets of the managed accounts.'))
+    parser.add_argument('--merge', action = 'store_true', help = 'add the rule to the existing lifecycle rules of a bucket instead of skipping the bucket')
+    parser.add_argument('--bucket-csv', action = 'store_true', help = f'read the buckets of each account from <account>{s3Bucket} instead of listing them')
+    parser.add_argument('--profile', action = 'store_true', help = f'profile the objects of each bucket, write the profiles to <account>{profileCSV} and only add the rule to eligible buckets')
+    args = parser.parse_args(argv)
+    metrics.start_metrics('add_intelligent_tier')      #Records API call counts and latency when CLOUDOPS_METRICS is set.
     try:
         accountNumber = read_csv(accountCSV)
-        for account in accountNumber:
-            accountARN = f'arn:aws:iam::{account}:role/AWSCloudFormationStackSetExecutionRole'
-            print(accountARN)
-            session = assumed_role_session(accountARN)
-            prefix = str(account) #Helps to create a separate csv file of ami backups for each account.
-            bucket_lifecycle(session, prefix,account)
-            
-            
-            
+        failedAccounts = []
+        with open_report(lcrCSV, lcrColumns, args.consolidated, args.report_format, 'Account#') as report, \
+             (open_report(profileCSV, profileColumns, args.consolidated, args.report_format, 'Account#') if args.profile else contextlib.nullcontext()) as profileReport:     #Rows are written by the reports' own threads while the accounts run.
+            for account, result, accountError in fan_out(accountNumber, lambda account: process_account(account, report, args.merge, args.bucket_csv, profileReport), accountWorkers):    #Accounts are processed concurrently, a failure in one account does not stop the others.
+                if accountError:
+                    print(f"An error has occurred in account {account}: {accountError}")
+                    failedAccounts.append(account)
+        if failedAccounts:
+            print(f"\nAccounts that failed: {', '.join(failedAccounts)}")
+
     except Exception as e:
         print(f"An error has occurred: {e}")
+    finally:
+        metrics.write_metrics()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1 @@
+#Offline benchmarks for the cloudops scripts, see run_benchmarks.py.
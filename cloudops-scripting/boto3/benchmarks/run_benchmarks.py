@@ -0,0 +1,137 @@
+#Runs the scripts end to end against the offline AWS simulator and reports wall time, API calls per operation, items returned and peak memory.
+#Run from the folder that holds the scripts:
+#   python -m benchmarks.run_benchmarks --accounts 20 --regions 8 --resources 200 --latency 50 --throttle 0.01
+
+import argparse
+import contextlib
+import csv
+import importlib
+import io
+import json
+import os
+import shlex
+import sys
+import tempfile
+import time
+import tracemalloc
+
+scriptFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if scriptFolder not in sys.path:
+    sys.path.insert(0, scriptFolder)
+
+from benchmarks.simulator import SimulatedAWS
+from cloudops import ratelimit, regions, session
+
+scriptNames = ['old_aws_ami_backups', 'delete_BackUpService_AMIs', 'delete_snapshots', 'delete_snapshots_with_deregister_AMI', 'rdsinstances', 'add_intelligent_tier', 'fleet_reports']
+
+#Environment that keeps boto3 away from real credentials, profiles and the instance metadata service.
+offlineEnvironment = {
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_SESSION_TOKEN': 'testing',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_EC2_METADATA_DISABLED': 'true',
+    'AWS_CONFIG_FILE': os.devnull,
+    'AWS_SHARED_CREDENTIALS_FILE': os.devnull,
+}
+
+#Writes a one column csv with a header row, the format read_csv() expects.
+def write_list(pathName, header, values):
+    with open(pathName, mode = 'w', newline = '') as file:
+        writer = csv.writer(file)
+        writer.writerow([header])
+        writer.writerows([value] for value in values)
+
+#Writes the input files a script reads from its working folder.
+def prepare_inputs(script, sim):
+    if script.__name__.startswith('delete_snapshots'):
+        with open(script.accountCSV, mode = 'w', newline = '') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Owner Id', 'Region Name', 'Snapshot Id', 'owner2', 'AMI', ' Cost - Simulated '])
+            writer.writerows(sim.snapshot_export_rows(withAmis = script.__name__ == 'delete_snapshots_with_deregister_AMI'))
+        return
+    write_list(script.accountCSV, 'Account', sim.accounts)
+    if script.__name__ == 'add_intelligent_tier':
+        for account in sim.accounts:
+            write_list(f'{account}{script.s3Bucket}', 'Bucket', sim.account_buckets(account))
+
+#Clears the process-wide pools so every script starts cold, the way a separate run would.
+def reset_state():
+    session.reset_pool()
+    regions.catalog = None
+    ratelimit.buckets.clear()
+
+#Runs one script's main() in a fresh folder against a fresh simulated world and returns its measurements, one result per run.
+#Later runs reuse the folder and the world, so they start from the caches and the changes the earlier runs left behind.
+def run_script(name, args):
+    sim = SimulatedAWS([100000000000 + index for index in range(args.accounts)], args.regions, args.resources, args.latency / 1000.0, args.throttle, args.seed)
+    script = importlib.import_module(name)
+    results = []
+    startFolder = os.getcwd()
+    with tempfile.TemporaryDirectory() as workFolder:
+        os.chdir(workFolder)
+        try:
+            prepare_inputs(script, sim)
+            for run in range(1, args.runs + 1):
+                reset_state()
+                session.sessionHooks[:] = [sim.attach]
+                sim.calls.clear()
+                sim.throttled.clear()
+                sim.items.clear()
+                output = io.StringIO()
+                tracemalloc.start()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(output):        #The scripts print a line per resource.
+                    script.main(shlex.split(args.script_args))
+                wallTime = time.perf_counter() - start
+                peakMemory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                results.append({
+                    'script': name if args.runs == 1 else f'{name} (run {run})',
+                    'wallSeconds': round(wallTime, 3),
+                    'apiCalls': sum(sim.calls.values()),
+                    'throttledCalls': sum(sim.throttled.values()),
+                    'itemsReturned': sum(sim.items.values()),
+                    'callsPerOperation': {f'{service}.{operation}': count for (service, operation), count in sorted(sim.calls.items())},
+                    'peakMemoryMB': round(peakMemory / (1024 * 1024), 2),
+                    'errorLines': sum(1 for line in output.getvalue().splitlines() if 'error' in line.lower()),    #Lines the scripts printed about failed calls.
+                })
+        finally:
+            os.chdir(startFolder)
+            session.sessionHooks[:] = []
+    return results
+
+#Prints the results as a table.
+def print_report(results, args):
+    print(f"accounts={args.accounts} regions={args.regions} resources={args.resources} latency={args.latency}ms throttle={args.throttle}")
+    print(f"{'script':<40}{'wall s':>10}{'API calls':>12}{'throttled':>11}{'items':>10}{'errors':>8}{'peak MB':>10}")
+    for result in results:
+        print(f"{result['script']:<40}{result['wallSeconds']:>10}{result['apiCalls']:>12}{result['throttledCalls']:>11}{result['itemsReturned']:>10}{result['errorLines']:>8}{result['peakMemoryMB']:>10}")
+        for operation, count in result['callsPerOperation'].items():
+            print(f"    {operation:<62}{count:>10}")
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = 'Offline end-to-end benchmark of the cloudops scripts.')
+    parser.add_argument('--accounts', type = int, default = 10, help = 'number of simulated accounts')
+    parser.add_argument('--regions', type = int, default = 4, help = 'number of enabled regions per account (max 17)')
+    parser.add_argument('--resources', type = int, default = 100, help = 'AMIs, snapshots, databases and buckets per account and region')
+    parser.add_argument('--latency', type = float, default = 20.0, help = 'latency added to every API call, in milliseconds')
+    parser.add_argument('--throttle', type = float, default = 0.0, help = 'fraction of API calls answered with a throttling error')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed for the simulated world')
+    parser.add_argument('--runs', type = int, default = 1, help = 'runs of each script in the same folder, later runs start from the caches of the earlier ones')
+    parser.add_argument('--scripts', nargs = '+', default = scriptNames, choices = scriptNames, help = 'scripts to run')
+    parser.add_argument('--script-args', default = '', help = "options passed to every script, for example --script-args='--profile'")
+    parser.add_argument('--json', help = 'also write the results to this JSON file')
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parse_args(argv)
+    os.environ.update(offlineEnvironment)
+    results = [result for name in args.scripts for result in run_script(name, args)]
+    print_report(results, args)
+    if args.json:
+        with open(args.json, mode = 'w') as file:
+            json.dump({'parameters': vars(args), 'results': results}, file, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+#Offline stand-in for the AWS APIs the scripts call.
+#Responses come from an in-memory world of N accounts x M regions x K resources and are returned through botocore's
+#before-call event, the same hook botocore's Stubber uses, so no request ever leaves the machine.
+#Every call can be given a fixed latency and a throttling rate, and is counted per operation.
+#An S3 bucket call sent to a region other than the bucket's costs a second round trip and is counted as s3.Redirect, the way S3 redirects it.
+#Buckets hold objects of a few typical layouts (logs, media, flat hashed keys, data sets), listed with list_objects_v2 like S3 lists them.
+
+import bisect
+import fnmatch
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from botocore.awsrequest import AWSResponse
+
+allRegions = ['us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'ca-central-1', 'eu-west-1', 'eu-west-2', 'eu-west-3',
+              'eu-central-1', 'eu-north-1', 'ap-south-1', 'ap-northeast-1', 'ap-northeast-2', 'ap-northeast-3',
+              'ap-southeast-1', 'ap-southeast-2', 'sa-east-1']
+disabledRegion = 'ap-southeast-4'           #Returned by describe_regions as not opted in.
+throttleCodes = {'ec2': 'RequestLimitExceeded', 's3': 'SlowDown'}      #Other services answer with ThrottlingException.
+pageSize = 100                              #Items per page when the caller does not pass a page size.
+bucketOperations = {'GetBucketLifecycleConfiguration', 'PutBucketLifecycleConfiguration', 'ListObjectsV2'}     #S3 calls that are redirected to the bucket's region.
+
+class SimulatedAWS:
+    def __init__(self, accounts, regions, resources, latency = 0.0, throttleRate = 0.0, seed = 0):
+        self.accounts = [str(account) for account in accounts]
+        self.regions = allRegions[:regions]
+        self.resources = resources
+        self.latency = latency
+        self.throttleRate = throttleRate
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.calls = Counter()              #(service, operation) -> calls
+        self.throttled = Counter()          #(service, operation) -> throttled calls
+        self.items = Counter()              #(service, operation) -> items returned, a stand-in for the response size
+        self.world = {}                     #(account, region) -> resources, generated on first use
+        self.buckets = {}                   #account -> {bucket name: bucket}, generated on first use
+        self.objects = {}                   #(account, bucket name) -> objects sorted by key, generated on first use
+        self.random = random.Random(seed)
+
+    #Registers the simulator on a boto3 session. Used as a cloudops.session hook so every pooled account session is served offline.
+    def attach(self, account, session):
+        session.events.register('before-parameter-build.*.*', self.capture_params)
+        session.events.register('before-call.*.*', partial(self.handle, str(account)))
+
+    #Keeps the caller's parameters, before-call only sees the serialized request.
+    def capture_params(self, params, context, **kwargs):
+        context['simulatedParams'] = dict(params)
+
+    #Serves one API call from the world.
+    def handle(self, account, model, context, **kwargs):
+        service = model.service_model.service_name
+        operation = model.name
+        region = context.get('client_region') or 'us-east-1'
+        params = context.get('simulatedParams', {})
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls[(service, operation)] += 1
+            if self.throttleRate and self.random.random() < self.throttleRate:
+                self.throttled[(service, operation)] += 1
+                return error_response(throttleCodes.get(service, 'ThrottlingException'), 'Rate exceeded', 503 if service == 's3' else 400)
+            handler = getattr(self, f'{service}_{operation}', None)
+            if handler is None:
+                return error_response('NotImplemented', f'{service}.{operation} is not simulated', 501)
+            response = handler(account, region, params)
+            self.items[(service, operation)] += sum(len(value) for value in response[1].values() if isinstance(value, list))
+            redirected = service == 's3' and operation in bucketOperations and self.bucket_region(account, params) not in (None, region)
+            if redirected:
+                self.calls[('s3', 'Redirect')] += 1
+        if redirected and self.latency:
+            time.sleep(self.latency)
+        return response
+
+    #Returns the resources of one (account, region), generating them the first time.
+    def region_world(self, account, region):
+        key = (account, region)
+        if key not in self.world:
+            self.world[key] = build_region(random.Random(f'{self.seed}:{account}:{region}'), account, region, self.resources)
+        return self.world[key]
+
+    #Returns the buckets of an account, spread over the simulated regions.
+    def account_buckets(self, account):
+        if account not in self.buckets:
+            self.buckets[account] = build_buckets(random.Random(f'{self.seed}:{account}:s3'), account, self.regions, self.resources)
+        return self.buckets[account]
+
+    #Returns the region of the bucket a call is for, None if there is no such bucket.
+    def bucket_region(self, account, params):
+        bucket = self.account_buckets(account).get(params.get('Bucket'))
+        return bucket['Region'] if bucket else None
+
+    #Returns the objects of a bucket as (key, size, last modified) sorted by key, None if there is no such bucket.
+    def bucket_objects(self, account, bucketName):
+        bucket = self.account_buckets(account).get(bucketName)
+        if bucket is None:
+            return None
+        key = (account, bucketName)
+        if key not in self.objects:
+            self.objects[key] = build_objects(random.Random(f'{self.seed}:{account}:{bucketName}'), bucket['Layout'])
+        return self.objects[key]
+
+    #Returns the orphan snapshots of every account and region, as rows of the cost export read by the snapshot scripts.
+    #With withAmis the snapshots of the "Backup-" AMIs are added too, with their AMI in the AMI column.
+    def snapshot_export_rows(self, withAmis = False):
+        rows = []
+        for account in self.accounts:
+            for region in self.regions:
+                world = self.region_world(account, region)
+                for snapshotId in world['orphanSnapshots']:
+                    rows.append([account, region, snapshotId, 'owner', '', '0.50'])
+                if withAmis:
+                    for image in world['images'].values():
+                        if image['Name'].startswith('Backup-'):
+                            rows.extend([account, region, device['Ebs']['SnapshotId'], 'owner', image['ImageId'], '0.50'] for device in image['BlockDeviceMappings'])
+        return rows
+
+    #EC2
+    def ec2_DescribeRegions(self, account, region, params):
+        regions = [{'RegionName': name, 'OptInStatus': 'opt-in-not-required'} for name in self.regions]
+        if params.get('AllRegions'):
+            regions.append({'RegionName': disabledRegion, 'OptInStatus': 'not-opted-in'})
+        return ok_response({'Regions': regions})
+
+    def ec2_DescribeImages(self, account, region, params):
+        images = self.region_world(account, region)['images']
+        if params.get('ImageIds'):
+            images = [images[imageId] for imageId in params['ImageIds'] if imageId in images]
+        else:
+            images = list(images.values())
+        images = apply_filters(images, params.get('Filters', []), {'name': 'Name', 'state': 'State', 'image-id': 'ImageId', 'creation-date': 'CreationDate'})
+        return page_response(images, params, 'Images', 'NextToken', 'NextToken', 'MaxResults')
+
+    def ec2_DescribeInstances(self, account, region, params):
+        instances = apply_filters(self.region_world(account, region)['instances'], params.get('Filters', []), {'instance-state-name': ('State', 'Name'), 'image-id': 'ImageId', 'launch-time': 'LaunchTime'})
+        reservations = [{'ReservationId': f'r-{instance["InstanceId"][2:]}', 'Instances': [instance]} for instance in instances]
+        return page_response(reservations, params, 'Reservations', 'NextToken', 'NextToken', 'MaxResults')
+
+    def ec2_DeregisterImage(self, account, region, params):
+        images = self.region_world(account, region)['images']
+        if params['ImageId'] not in images:
+            return error_response('InvalidAMIID.NotFound', f"The image id '[{params['ImageId']}]' does not exist", 400)
+        del images[params['ImageId']]
+        return ok_response({})
+
+    def ec2_DeleteSnapshot(self, account, region, params):
+        snapshots = self.region_world(account, region)['snapshots']
+        if params['SnapshotId'] not in snapshots:
+            return error_response('InvalidSnapshot.NotFound', f"The snapshot '{params['SnapshotId']}' does not exist.", 400)
+        snapshots.discard(params['SnapshotId'])
+        return ok_response({})
+
+    #RDS
+    def rds_DescribeDBInstances(self, account, region, params):
+        return page_response(self.region_world(account, region)['dbInstances'], params, 'DBInstances', 'Marker', 'Marker', 'MaxRecords')
+
+    def rds_DescribeDBClusters(self, account, region, params):
+        return page_response(self.region_world(account, region)['dbClusters'], params, 'DBClusters', 'Marker', 'Marker', 'MaxRecords')
+
+    #AWS Backup
+    def backup_ListBackupVaults(self, account, region, params):
+        vaults = [{'BackupVaultName': name, 'BackupVaultArn': f'arn:aws:backup:{region}:{account}:backup-vault:{name}'} for name in self.region_world(account, region)['vaults']]
+        return page_response(vaults, params, 'BackupVaultList', 'NextToken', 'NextToken', 'MaxResults')
+
+    def backup_ListRecoveryPointsByBackupVault(self, account, region, params):
+        recoveryPoints = self.region_world(account, region)['vaults'].get(params['BackupVaultName'], [])
+        if params.get('ByResourceType'):
+            recoveryPoints = [point for point in recoveryPoints if point['ResourceType'] == params['ByResourceType']]
+        return page_response(recoveryPoints, params, 'RecoveryPoints', 'NextToken', 'NextToken', 'MaxResults')
+
+    #S3
+    def s3_ListBuckets(self, account, region, params):
+        buckets = [{'Name': name, 'CreationDate': datetime(2020, 1, 1, tzinfo = timezone.utc), 'BucketRegion': bucket['Region']} for name, bucket in self.account_buckets(account).items()]
+        return page_response(buckets, params, 'Buckets', 'ContinuationToken', 'ContinuationToken', 'MaxBuckets')
+
+    def s3_GetBucketLocation(self, account, region, params):
+        bucket = self.account_buckets(account).get(params['Bucket'])
+        if bucket is None:
+            return error_response('NoSuchBucket', 'The specified bucket does not exist', 404)
+        return ok_response({} if bucket['Region'] == 'us-east-1' else {'LocationConstraint': bucket['Region']})     #us-east-1 has no location constraint.
+
+    #Lists keys in order from the prefix, after StartAfter or from the position in the ContinuationToken. With a Delimiter the keys
+    #that hold it after the prefix are rolled up into one CommonPrefixes entry each, and MaxKeys counts both kinds of entries.
+    def s3_ListObjectsV2(self, account, region, params):
+        objects = self.bucket_objects(account, params['Bucket'])
+        if objects is None:
+            return error_response('NoSuchBucket', 'The specified bucket does not exist', 404)
+        prefix = params.get('Prefix') or ''
+        delimiter = params.get('Delimiter')
+        size = int(params.get('MaxKeys') or 1000)
+        if params.get('ContinuationToken'):
+            position = int(params['ContinuationToken'])
+        else:
+            position = max(bisect.bisect_left(objects, prefix, key = object_key), bisect.bisect_right(objects, params.get('StartAfter') or '', key = object_key))
+        contents = []
+        commonPrefixes = []
+        while position < len(objects) and objects[position][0].startswith(prefix) and len(contents) + len(commonPrefixes) < size:
+            key, objectSize, modified = objects[position]
+            cut = key.find(delimiter, len(prefix)) if delimiter else -1
+            if cut >= 0:
+                commonPrefixes.append({'Prefix': key[:cut + len(delimiter)]})
+                position = bisect.bisect_left(objects, key[:cut + len(delimiter)] + '\U0010ffff', key = object_key)      #Past every key under the common prefix.
+                continue
+            contents.append({'Key': key, 'Size': objectSize, 'LastModified': modified, 'StorageClass': 'STANDARD'})
+            position += 1
+        truncated = position < len(objects) and objects[position][0].startswith(prefix)
+        body = {'Prefix': prefix, 'MaxKeys': size, 'KeyCount': len(contents) + len(commonPrefixes), 'IsTruncated': truncated}
+        if contents:
+            body['Contents'] = contents
+        if commonPrefixes:
+            body['CommonPrefixes'] = commonPrefixes
+        if truncated:
+            body['NextContinuationToken'] = str(position)
+        return ok_response(body)
+
+    def s3_GetBucketLifecycleConfiguration(self, account, region, params):
+        bucket = self.account_buckets(account).get(params['Bucket'])
+        if bucket is None:
+            return error_response('NoSuchBucket', 'The specified bucket does not exist', 404)
+        if not bucket['Rules']:
+            return error_response('NoSuchLifecycleConfiguration', 'The lifecycle configuration does not exist', 404)
+        return ok_response({'Rules': [dict(rule) for rule in bucket['Rules']]})
+
+    def s3_PutBucketLifecycleConfiguration(self, account, region, params):
+        bucket = self.account_buckets(account).get(params['Bucket'])
+        if bucket is None:
+            return error_response('NoSuchBucket', 'The specified bucket does not exist', 404)
+        bucket['Rules'] = [dict(rule) for rule in params['LifecycleConfiguration']['Rules']]
+        return ok_response({})
+
+#Generates the EC2, RDS and AWS Backup resources of one (account, region).
+def build_region(rng, account, region, resources):
+    now = datetime.now(timezone.utc)
+    images = {}
+    snapshots = set()
+    vaults = {'Default': [], 'Secondary': []}
+    for index in range(resources):
+        imageId = f'ami-{rng.getrandbits(64):017x}'
+        kind = index % 3
+        name = [f'Backup-server{index}', f'AwsBackup_i-{index:08x}', f'app-server{index}'][kind]
+        created = now - timedelta(days = rng.choice([30, 120, 200, 400]))
+        devices = []
+        for device in range(rng.choice([1, 1, 2])):
+            snapshotId = f'snap-{rng.getrandbits(64):017x}'
+            snapshots.add(snapshotId)
+            devices.append({'DeviceName': f'/dev/sd{"abc"[device]}', 'Ebs': {'SnapshotId': snapshotId, 'VolumeSize': rng.choice([8, 30, 100]), 'VolumeType': 'gp3'}})
+        images[imageId] = {'ImageId': imageId, 'Name': name, 'State': 'available', 'OwnerId': account, 'ImageLocation': f'{account}/{name}',
+                           'CreationDate': created.strftime('%Y-%m-%dT%H:%M:%S.000Z'), 'BlockDeviceMappings': devices}
+        if kind == 1:
+            vaultName = 'Default' if index % 2 else 'Secondary'
+            vaults[vaultName].append({'RecoveryPointArn': f'arn:aws:ec2:{region}::image/{imageId}', 'BackupVaultName': vaultName, 'ResourceType': 'EC2'})
+    imageIds = list(images)
+    instances = []
+    for index in range(resources // 4):
+        instances.append({'InstanceId': f'i-{rng.getrandbits(64):017x}', 'ImageId': imageIds[(index * 5) % len(imageIds)] if imageIds else 'ami-0',
+                          'State': {'Name': rng.choice(['running', 'running', 'stopped'])},
+                          'LaunchTime': (now - timedelta(days = [1, 10, 100][index % 3])).strftime('%Y-%m-%dT%H:%M:%S.000Z')})
+    orphans = [f'snap-{rng.getrandbits(64):017x}' for index in range(resources)]
+    snapshots.update(orphans)
+    dbInstances = []
+    for index in range(resources // 2):
+        dbInstances.append({'DBInstanceIdentifier': f'db-{region}-{index}', 'MultiAZ': index % 2 == 0, 'Engine': rng.choice(['mysql', 'postgres', 'aurora-mysql']),
+                            'EngineVersion': '8.0.35', 'DBInstanceClass': 'db.t3.medium', 'StorageType': 'gp3', 'AllocatedStorage': 100,
+                            'BackupRetentionPeriod': 7, 'DBInstanceStatus': 'available', 'AvailabilityZone': f'{region}a'})
+    dbClusters = []
+    auroraInstances = [db for db in dbInstances if db['Engine'].startswith('aurora')]
+    for start in range(0, len(auroraInstances), 2):       #Aurora instances are grouped into clusters of two.
+        clusterId = f'cluster-{region}-{start // 2}'
+        members = auroraInstances[start:start + 2]
+        for db in members:
+            db['DBClusterIdentifier'] = clusterId
+        dbClusters.append({'DBClusterIdentifier': clusterId, 'Engine': 'aurora-mysql', 'EngineVersion': '8.0.mysql_aurora.3.05.2', 'Status': 'available',
+                           'MultiAZ': len(members) > 1, 'StorageEncrypted': True, 'BackupRetentionPeriod': 7, 'AllocatedStorage': 1,
+                           'AvailabilityZones': [f'{region}a', f'{region}b'],
+                           'DBClusterMembers': [{'DBInstanceIdentifier': db['DBInstanceIdentifier'], 'IsClusterWriter': position == 0} for position, db in enumerate(members)]})
+    return {'images': images, 'snapshots': snapshots, 'orphanSnapshots': orphans, 'instances': instances, 'vaults': vaults,
+            'dbInstances': dbInstances, 'dbClusters': dbClusters}
+
+#Generates the buckets of one account, their regions and lifecycle rules.
+def build_buckets(rng, account, regions, resources):
+    buckets = {}
+    for index in range(resources):
+        rules = [{'ID': 'ExpireLogs', 'Prefix': 'logs/', 'Status': 'Enabled', 'Expiration': {'Days': 90}}] if index % 4 == 0 else []
+        buckets[f'{account}-bucket-{index}'] = {'Region': regions[index % len(regions)], 'Rules': rules, 'Layout': bucketLayouts[index % len(bucketLayouts)]}
+    return buckets
+
+#Object layouts of the simulated buckets, in turn: small log files, media that is mostly large, flat hashed keys of every size
+#in one level, too many for one delimited page, a data set of large files, and an empty bucket.
+bucketLayouts = ['logs', 'media', 'flat', 'dataset', 'logs', 'media', 'flat', 'empty']
+
+#Generates the objects of a bucket with the given layout, as (key, size, last modified) sorted by key.
+def build_objects(rng, layout):
+    now = datetime.now(timezone.utc)
+    objects = []
+    def add(key, size):
+        objects.append((key, size, now - timedelta(days = rng.uniform(0, 720))))
+    if layout == 'logs':
+        for index in range(600):
+            add(f'logs/{2024 + index % 2}/{index % 12 + 1:02d}/{index:06d}.log.gz', rng.randint(200, 60 * 1024))
+    elif layout == 'media':
+        for index in range(400):
+            folder = ['images', 'thumbnails', 'video'][index % 3]
+            size = {'images': rng.randint(200 * 1024, 8 * 1024 ** 2), 'thumbnails': rng.randint(4 * 1024, 48 * 1024), 'video': rng.randint(50 * 1024 ** 2, 2 * 1024 ** 3)}[folder]
+            add(f'{folder}/{index:06d}.bin', size)
+    elif layout == 'flat':
+        for index in range(2500):
+            add(f'{rng.getrandbits(64):016x}', int(rng.lognormvariate(11, 2.5)))
+    elif layout == 'dataset':
+        for index in range(300):
+            add(f"{['raw', 'curated'][index % 2]}/part-{index:05d}.parquet", rng.randint(1024 ** 2, 100 * 1024 ** 2))
+    objects.sort()
+    return objects
+
+#Sort key of a simulated object.
+def object_key(s3Object):
+    return s3Object[0]
+
+#Keeps the items that match every filter. fields maps a filter name to the item key, or a (key, subkey) pair.
+def apply_filters(items, filters, fields):
+    for itemFilter in filters:
+        field = fields.get(itemFilter['Name'])
+        if field is None:
+            continue
+        def value(item):
+            return item[field[0]][field[1]] if isinstance(field, tuple) else item.get(field)
+        items = [item for item in items if any(fnmatch.fnmatchcase(str(value(item)), pattern) for pattern in itemFilter['Values'])]
+    return items
+
+#Returns one page of items and a token for the next page, the way paginated AWS calls do.
+def page_response(items, params, resultKey, inputToken, outputToken, limitKey):
+    start = int(params.get(inputToken) or 0)
+    size = int(params.get(limitKey) or pageSize)
+    body = {resultKey: items[start:start + size]}
+    if start + size < len(items):
+        body[outputToken] = str(start + size)
+    return ok_response(body)
+
+def ok_response(body):
+    body['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RetryAttempts': 0}
+    return AWSResponse(None, 200, {}, None), body
+
+def error_response(code, message, status):
+    return AWSResponse(None, status, {}, None), {'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': status, 'RetryAttempts': 0}}
@@ -0,0 +1 @@
+#Shared helpers used by the cloudops boto3 scripts in the parent folder.
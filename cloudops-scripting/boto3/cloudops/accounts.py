@@ -0,0 +1,16 @@
+#Managed account lists shared by the scripts.
+
+import csv
+
+#Reads a csv file of managed accounts and returns the account numbers in a list.
+def read_csv(pathName):
+    accountNum = []     #List to store account numbers.
+    lineCount = 0
+    with open(pathName, mode = 'r') as file:
+        accountsList = list(csv.reader(file))
+        for acct in accountsList:   #Reads the csv file with managed accounts and appends the account numbers to a list.
+            if lineCount == 0:
+                lineCount += 1
+                continue
+            accountNum.append(acct[0])
+    return accountNum
@@ -0,0 +1,134 @@
+#S3 object profiles that decide which buckets are worth the intelligent tiering rule. The keys of a bucket are split into shards, by the
+#prefixes a delimited listing finds and by key ranges inside prefixes too large for that, and the shards are listed by parallel
+#list_objects_v2 streams. Every stream folds its objects into fixed size and age histograms, so a profile takes the same memory for a
+#hundred keys as for hundreds of millions, and a per-bucket key budget bounds the time the largest buckets can take.
+#Intelligent tiering never moves objects under 128 KB, but the transition is still charged per object, so a bucket whose bytes are
+#mostly in small objects is not eligible.
+
+import bisect
+from datetime import datetime, timezone
+from cloudops.fanout import fan_out
+from cloudops.inventory import paginate
+
+smallObjectSize = 128 * 1024            #Objects below this size are not monitored or moved by intelligent tiering.
+sizeBounds = [4 * 1024, 32 * 1024, smallObjectSize, 1024 ** 2, 16 * 1024 ** 2, 128 * 1024 ** 2, 1024 ** 3]     #Upper bounds of the size bins, the last bin has none.
+sizeLabels = ['<4KB', '4-32KB', '32-128KB', '128KB-1MB', '1-16MB', '16-128MB', '128MB-1GB', '>=1GB']
+ageBounds = [30, 90, 180, 365]          #Upper bounds of the age bins, in days since the object was last modified.
+ageLabels = ['<30d', '30-90d', '90-180d', '180-365d', '>=365d']
+minLargeShare = 0.5                     #Share of a bucket's bytes that must be in objects of smallObjectSize or more.
+delimiter = '/'
+levelKeys = 1000                        #Entries of one delimited listing page. A prefix with more entries is split into key ranges instead.
+shardTarget = 16                        #Prefix levels are expanded until a bucket has at least this many shards.
+maxShardDepth = 3                       #Deepest prefix level expanded.
+rangeBounds = ['2', '4', '6', '8', 'A', 'I', 'Q', 'a', 'c', 'e', 'g', 'k', 'o', 's', 'w']     #First characters the keys of a large prefix are split on, one key range per gap.
+shardWorkers = 8                        #Shards of a bucket listed at the same time.
+maxKeys = 10000000                      #Most keys listed per bucket, shared evenly by its shards. A profile that reaches it is marked sampled.
+
+profileColumns = ['Bucket', 'Objects', 'Bytes', 'LargeByteShare', 'Shards', 'Sampled', 'Eligible', 'Reason'] + \
+                 [f'Size {label}' for label in sizeLabels] + [f'Age {label}' for label in ageLabels]
+
+#Returns an empty histogram.
+def new_histogram():
+    return {'Objects': 0, 'Bytes': 0, 'LargeBytes': 0, 'Sizes': [0] * len(sizeLabels), 'Ages': [0] * len(ageLabels), 'Sampled': False, 'Shards': 0}
+
+#Adds one object of a listing to a histogram.
+def add_object(histogram, s3Object, now):
+    size = s3Object.get('Size', 0)
+    histogram['Objects'] += 1
+    histogram['Bytes'] += size
+    if size >= smallObjectSize:
+        histogram['LargeBytes'] += size
+    histogram['Sizes'][bisect.bisect_right(sizeBounds, size)] += 1
+    histogram['Ages'][bisect.bisect_right(ageBounds, (now - s3Object['LastModified']).days)] += 1
+
+#Adds the counts of other to histogram.
+def merge_histogram(histogram, other):
+    for key in ('Objects', 'Bytes', 'LargeBytes'):
+        histogram[key] += other[key]
+    for key in ('Sizes', 'Ages'):
+        histogram[key] = [count + otherCount for count, otherCount in zip(histogram[key], other[key])]
+    histogram['Sampled'] = histogram['Sampled'] or other['Sampled']
+
+#Lists one level under prefix with a single delimited call. Returns (sub-prefixes, objects directly under prefix),
+#or None when the level does not fit in one page.
+def list_level(s3, bucket, prefix):
+    page = s3.list_objects_v2(Bucket = bucket, Prefix = prefix, Delimiter = delimiter, MaxKeys = levelKeys)
+    if page.get('IsTruncated'):
+        return None
+    return [common['Prefix'] for common in page.get('CommonPrefixes', [])], page.get('Contents', [])
+
+#Splits the keys under prefix into key ranges on rangeBounds, as (prefix, startAfter, stopAt) shards.
+#A range starts after the largest key that sorts below its first character and stops at the first key of the next range.
+def key_ranges(prefix):
+    starts = [None] + [prefix + chr(ord(bound) - 1) + '\U0010ffff' for bound in rangeBounds]
+    stops = [prefix + bound for bound in rangeBounds] + [None]
+    return [(prefix, start, stop) for start, stop in zip(starts, stops)]
+
+#Returns the shards of a bucket as (prefix, startAfter, stopAt), and the histogram of the objects found while planning them.
+#Prefix levels are expanded breadth first, a level at a time in parallel, until there are shardTarget shards. A prefix whose level
+#is too large for one page is split into key ranges, which also covers buckets with flat key names.
+def plan_shards(s3, bucket, now):
+    histogram = new_histogram()
+    shards = []
+    prefixes = ['']
+    depth = 0
+    while prefixes and depth < maxShardDepth and len(shards) + len(prefixes) < shardTarget:
+        expanded = []
+        for prefix, level, levelError in fan_out(prefixes, lambda prefix: list_level(s3, bucket, prefix), shardWorkers):
+            if levelError:
+                raise levelError
+            if level is None:
+                shards.extend(key_ranges(prefix))
+                continue
+            subPrefixes, s3Objects = level
+            for s3Object in s3Objects:
+                add_object(histogram, s3Object, now)
+            expanded.extend(subPrefixes)
+        prefixes = expanded
+        depth += 1
+    shards.extend((prefix, None, None) for prefix in prefixes)
+    return shards, histogram
+
+#Lists the objects of one shard into a new histogram, at most limit of them. The listing stops at the end of the shard's key range.
+def profile_shard(s3, bucket, shard, limit, now):
+    prefix, startAfter, stopAt = shard
+    histogram = new_histogram()
+    extra = {'StartAfter': startAfter} if startAfter else {}
+    for s3Object in paginate(s3, 'list_objects_v2', 'Contents', Bucket = bucket, Prefix = prefix, PaginationConfig = {'PageSize': 1000}, **extra):
+        if stopAt is not None and s3Object['Key'] >= stopAt:
+            break
+        if histogram['Objects'] >= limit:
+            histogram['Sampled'] = True
+            break
+        add_object(histogram, s3Object, now)
+    return histogram
+
+#Profiles the objects of a bucket with the bucket's own s3 client and returns its histogram. Shards are listed shardWorkers at a time.
+def profile_bucket(s3, bucket):
+    now = datetime.now(timezone.utc)
+    shards, histogram = plan_shards(s3, bucket, now)
+    limit = max(1, maxKeys // max(1, len(shards)))
+    for shard, shardHistogram, shardError in fan_out(shards, lambda shard: profile_shard(s3, bucket, shard, limit, now), shardWorkers):
+        if shardError:
+            raise shardError
+        merge_histogram(histogram, shardHistogram)
+    histogram['Shards'] = len(shards)
+    return histogram
+
+#Returns the share of the profiled bytes that are in objects of smallObjectSize or more.
+def large_share(histogram):
+    return histogram['LargeBytes'] / histogram['Bytes'] if histogram['Bytes'] else 0.0
+
+#Decides if a profiled bucket should get the intelligent tiering rule. Returns (eligible, reason).
+def eligibility(histogram):
+    if not histogram['Objects']:
+        return False, 'empty'
+    if large_share(histogram) < minLargeShare:
+        return False, 'small objects'
+    return True, 'large objects'
+
+#Returns the profile row of a bucket in profileColumns order.
+def profile_row(bucket, histogram):
+    eligible, reason = eligibility(histogram)
+    return [bucket, histogram['Objects'], histogram['Bytes'], round(large_share(histogram), 3), histogram['Shards'], histogram['Sampled'],
+            eligible, reason] + histogram['Sizes'] + histogram['Ages']
@@ -0,0 +1,70 @@
+#S3 bucket discovery and region routing. The buckets of an account are listed with a paginated list_buckets, and every bucket call
+#is sent to a pooled client of the bucket's own region, so S3 never has to redirect it. Bucket regions are kept in a cache on disk,
+#a bucket's region only has to be looked up once.
+
+import json
+import os
+import threading
+from cloudops.inventory import paginate
+from cloudops.session import get_client
+
+bucketCache = '.bucket_region_cache.json'   #File that stores bucket -> region between runs.
+defaultRegion = 'us-east-1'                 #Region of buckets without a location constraint.
+legacyLocations = {'EU': 'eu-west-1'}       #Location constraints of old buckets that are not region names.
+
+cacheLock = threading.Lock()
+cache = None            #{account: {bucket: region}}, loaded on first use.
+
+#Loads the cache from disk, returns an empty cache if the file is missing or unreadable.
+def load_cache():
+    try:
+        with open(bucketCache, mode = 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+#Returns the cached regions of an account, loading the cache first if needed. Called with cacheLock held.
+def account_regions(account):
+    global cache
+    if cache is None:
+        cache = load_cache()
+    return cache.setdefault(str(account), {})
+
+#Writes the cache to disk. Regions written by other processes are kept, and the file is replaced in one step.
+def save_cache():
+    with cacheLock:
+        if cache is None:
+            return
+        for account, regions in load_cache().items():
+            cache[account] = {**regions, **cache.get(account, {})}
+        tempPath = f'{bucketCache}.{os.getpid()}.tmp'
+        with open(tempPath, mode = 'w') as file:
+            json.dump(cache, file, indent = 1, sort_keys = True)
+        os.replace(tempPath, bucketCache)
+
+#Returns the names of the account's buckets from a paginated list_buckets. The regions the listing returns are added to the cache.
+def discover_buckets(account):
+    names = []
+    regions = {}
+    for bucket in paginate(get_client(account, 's3'), 'list_buckets', 'Buckets'):
+        names.append(bucket['Name'])
+        if bucket.get('BucketRegion'):
+            regions[bucket['Name']] = bucket['BucketRegion']
+    with cacheLock:
+        account_regions(account).update(regions)
+    return names
+
+#Returns the region of a bucket, from the cache or from get_bucket_location, which answers from any region.
+def bucket_region(account, bucket):
+    with cacheLock:
+        region = account_regions(account).get(bucket)
+    if region is None:
+        location = get_client(account, 's3').get_bucket_location(Bucket = bucket).get('LocationConstraint')
+        region = legacyLocations.get(location, location) or defaultRegion
+        with cacheLock:
+            account_regions(account)[bucket] = region
+    return region
+
+#Returns the pooled s3 client of the bucket's region.
+def bucket_client(account, bucket):
+    return get_client(account, 's3', bucket_region(account, bucket))
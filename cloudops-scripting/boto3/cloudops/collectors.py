@@ -0,0 +1,45 @@
+#Collectors of the fused scanner for the reports of the scripts. The AMI collectors use the retention policy sections and the in-use
+#check of their scripts, so they list what those scripts would act on without changing anything. The RDS collectors write the
+#inventory and MultiAZ reports of rdsinstances.py. Importing this module registers them.
+
+from cloudops.instances import index_instances
+from cloudops.rds_inventory import inventoryColumns, inventory_rows, multiAZ_rows
+from cloudops.retention import load_policy, select_images, account_skipped
+from cloudops.scanner import Collector, register_collector
+
+amiColumns = ['Name', 'ImageID', 'ImageLocation', 'CreationDate', 'Region', 'OwnerID', 'SnapshotID', 'Volume Size']
+multiAzColumns = ['DBIdentifier', 'MultiAZStatus']
+
+#Returns the AMIs of a region that the retention policy selects. They are the collector's candidates, the scanner re-reads the
+#ones that came from the inventory store, and the policy selects again on the current records when the collector runs.
+def policy_images(scan, policyName):
+    policy = load_policy(policyName)
+    if account_skipped(policy, scan.Account):
+        return []
+    return select_images(policy, scan.Items['images'])
+
+#Returns the AMIs of a region that the retention policy selects and that no active instance was launched from.
+def unused_policy_images(scan, policyName):
+    imageIndex = index_instances(scan.Items['instances'])
+    return [image for image in policy_images(scan, policyName) if image['ImageId'] not in imageIndex]
+
+#Returns a row per snapshot of the AMIs the policy would clean up in one region.
+def ami_rows(scan, policyName):
+    return [[image['Name'], image['ImageId'], image.get('ImageLocation', ''), image.get('CreationDate', ''), scan.Region, image.get('OwnerId', ''),
+             device['Ebs']['SnapshotId'], device['Ebs'].get('VolumeSize', '')]
+            for image in unused_policy_images(scan, policyName) for device in image.get('BlockDeviceMappings', []) if device.get('Ebs')]
+
+#Returns the inventory rows of the DB instances and clusters of one region.
+def rds_rows(scan):
+    return inventory_rows(scan.Account, scan.Region, scan.Items['db_instances'], scan.Items['db_clusters'])
+
+#Returns the MultiAZ rows of the DB instances of one region.
+def multi_az_collector(scan):
+    return multiAZ_rows(inventory_rows(scan.Account, scan.Region, scan.Items['db_instances'], []))
+
+register_collector(Collector('old_ami_backups', ['images', 'instances'], lambda scan: ami_rows(scan, 'old_aws_ami_backups'), '_old_ami_backups_found.csv', amiColumns, None,
+                             lambda scan: policy_images(scan, 'old_aws_ami_backups')))
+register_collector(Collector('backup_service_amis', ['images', 'instances'], lambda scan: ami_rows(scan, 'delete_BackUpService_AMIs'), '_backup_service_amis_found.csv', amiColumns, None,
+                             lambda scan: policy_images(scan, 'delete_BackUpService_AMIs')))
+register_collector(Collector('rds_inventory', ['db_instances', 'db_clusters'], rds_rows, '_rds_inventory.csv', inventoryColumns, 'Account'))
+register_collector(Collector('rds_multiAZ', ['db_instances'], multi_az_collector, '_multiAZ_rds.csv', multiAzColumns, None))
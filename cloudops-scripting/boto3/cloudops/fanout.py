@@ -0,0 +1,45 @@
+#Runs per-account and per-region work concurrently. Most of a run is spent waiting on the network, so work items are processed by a pool of threads.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cloudops.session import get_client
+
+#Runs worker(item) for every item (an account or a region) on a pool of maxWorkers threads.
+#Yields (item, result, error) in the same order as the input, so output written from the results matches a serial run.
+#An exception raised for one item is returned as its error and never stops the other items.
+def fan_out(items, worker, maxWorkers):
+    with ThreadPoolExecutor(max_workers = maxWorkers) as pool:
+        futures = [(item, pool.submit(worker, item)) for item in items]
+        for item, future in futures:
+            try:
+                yield item, future.result(), None
+            except Exception as itemError:
+                yield item, None, itemError
+
+#Runs scan(region, client) for every region with at most maxInFlight regions in flight and returns the results in region order.
+#Every region is scanned even if one fails. Failed regions are returned so the caller can write the other results before reporting them.
+def scan_regions(account, service, regions, scan, maxInFlight):
+    results = []
+    failedRegions = []
+    for region, result, regionError in fan_out(regions, lambda region: scan(region, get_client(account, service, region)), maxInFlight):
+        if regionError:
+            print(f"An error has occurred in region {region}: {regionError}")
+            failedRegions.append(region)
+            continue
+        results.append(result)
+    return results, failedRegions
+
+#Returns a function region -> build(region) that runs build once per region, on first use, and then returns the saved result.
+#Threads asking for the same region wait for the first build, threads asking for other regions are not held up.
+def once_per_region(build):
+    results = {}
+    regionLocks = {}
+    locksLock = threading.Lock()
+    def region_result(region):
+        with locksLock:
+            regionLock = regionLocks.setdefault(region, threading.Lock())
+        with regionLock:
+            if region not in results:
+                results[region] = build(region)
+            return results[region]
+    return region_result
@@ -0,0 +1,29 @@
+#Helpers for finding the AMIs that reference a snapshot and the state of those AMIs with as few describe_images calls as possible.
+
+from cloudops.inventory import iter_images, paginate
+
+stateBatch = 200        #Image IDs sent in one describe_images call, the most values the image-id filter takes.
+
+#Builds a map of snapshot ID -> images that reference it, from one paginated describe_images pass over the images the account owns.
+def snapshot_image_map(ec2):
+    snapshotImages = {}
+    for image in iter_images(ec2):
+        for device in image.get('BlockDeviceMappings', []):
+            snapshotId = device.get('Ebs', {}).get('SnapshotId')
+            if snapshotId:
+                snapshotImages.setdefault(snapshotId, []).append(image)
+    return snapshotImages
+
+#Returns image ID -> current image record, tags included, for the given image IDs, looked up stateBatch IDs per call.
+#Images that no longer exist are left out. The image-id filter is used instead of ImageIds so one missing image does not fail the whole batch.
+def image_records(ec2, imageIds):
+    imageIds = sorted(set(imageIds))
+    records = {}
+    for start in range(0, len(imageIds), stateBatch):
+        for image in paginate(ec2, 'describe_images', 'Images', Filters = [{'Name': 'image-id', 'Values': imageIds[start:start + stateBatch]}]):
+            records[image['ImageId']] = image
+    return records
+
+#Returns image ID -> state for the given image IDs. Images that no longer exist are left out.
+def image_states(ec2, imageIds):
+    return {imageId: image['State'] for imageId, image in image_records(ec2, imageIds).items()}
@@ -0,0 +1,30 @@
+#Helpers for looking up which AMIs are used by EC2 instances.
+
+from cloudops.fanout import once_per_region
+from cloudops.inventory import activeStates, iter_instances
+from cloudops.inventory_cache import cached_instances
+from cloudops.session import get_client
+
+#Builds an index of image ID -> instance IDs from a list of instances.
+def index_instances(instances):
+    index = {}
+    for instance in instances:
+        index.setdefault(instance['ImageId'], []).append(instance['InstanceId'])
+    return index
+
+#Builds an index of image ID -> instance IDs for every instance in a region. Built once per (account, region) and reused for every AMI.
+def image_index(ec2):
+    return index_instances(iter_instances(ec2, activeStates))     #Follows every page so large regions are fully covered.
+
+#Returns a function region -> image index for one account. Each region's index is built once, on first use,
+#from the local inventory store so only the instances launched since the last run are fetched.
+def image_index_cache(account):
+    return once_per_region(lambda region: index_instances(cached_instances(get_client(account, 'ec2', region), account, region)))
+
+#Check if ami was used to launch an existing EC2 instance using a prebuilt image index.
+def ami_inUse(imageIndex, imageId):
+    instances = imageIndex.get(imageId)
+    if instances:
+        print(f"{imageId} was used to launch an existing EC2 instance: {', '.join(instances)}")
+        return True
+    return False
@@ -0,0 +1,35 @@
+#Lazy, paginated inventory streams for the describe/list calls the scripts make.
+#Every page is followed, and filters are sent to the API where it supports them so less data is downloaded per region.
+
+#Yields every item of a paginated call, one page at a time.
+def paginate(client, operation, resultKey, **kwargs):
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        yield from page.get(resultKey, [])
+
+#Yields the AMIs owned by the account.
+def iter_images(ec2):
+    return paginate(ec2, 'describe_images', 'Images', Owners = ['self'])   #The 'self' value scopes the images to just the specified account.
+
+#Instance states that still depend on the AMI they were launched from. Terminated instances are left out.
+activeStates = ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
+
+#Yields the EC2 instances in the given states, flattened out of their reservations. filters are added to the state filter.
+def iter_instances(ec2, states, filters = ()):
+    for reservation in paginate(ec2, 'describe_instances', 'Reservations', Filters = [{'Name': 'instance-state-name', 'Values': states}, *filters]):
+        yield from reservation['Instances']     #Every instance in the reservation, not just the first one.
+
+#Yields the RDS instances in the region.
+def iter_db_instances(rds):
+    return paginate(rds, 'describe_db_instances', 'DBInstances')
+
+#Yields the RDS and Aurora DB clusters in the region.
+def iter_db_clusters(rds):
+    return paginate(rds, 'describe_db_clusters', 'DBClusters')
+
+#Yields the AWS Backup vaults in the region.
+def iter_backup_vaults(backup):
+    return paginate(backup, 'list_backup_vaults', 'BackupVaultList')
+
+#Yields the recovery points of one resource type in a vault, the resource type is filtered on the server.
+def iter_recovery_points(backup, vaultName, resourceType = 'EC2'):
+    return paginate(backup, 'list_recovery_points_by_backup_vault', 'RecoveryPoints', BackupVaultName = vaultName, ByResourceType = resourceType)
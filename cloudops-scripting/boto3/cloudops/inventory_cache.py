@@ -0,0 +1,116 @@
+#Local inventory store for the AMI scripts, one file per (account, region, resource type) with the time it was fetched.
+#A run that finds a fresh enough entry only asks EC2 for what changed since: images created and instances launched since the last fetch,
+#through the creation-date and launch-time filters. The entry is downloaded in full again once it is older than fullRefreshDays.
+#Images deregistered or retagged since the last fetch cannot be seen through a filter, so the images a script is about to act on are
+#re-read in batches first and selected again on their current records, tags included. The missing ones are dropped from the store.
+
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from cloudops.images import image_records
+from cloudops.inventory import activeStates, iter_images, iter_instances, paginate
+
+inventoryCache = '.inventory_cache'     #Folder that stores the inventory between runs.
+fullRefreshDays = 30                    #Days before an entry is downloaded in full again. 0 turns the store off.
+maxDeltaDays = 150                      #Older entries are refreshed in full, a delta filter takes one value per day.
+
+#Returns the path of the file for (account, region, resource type).
+def cache_path(account, region, resourceType):
+    return os.path.join(inventoryCache, str(account), region, f'{resourceType}.json')
+
+#Loads an entry, returns None if it is missing or unreadable.
+def load_entry(account, region, resourceType):
+    try:
+        with open(cache_path(account, region, resourceType), mode = 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+#Writes an entry. The file is replaced in one step so a crash never leaves a partial entry.
+def save_entry(account, region, resourceType, entry):
+    pathName = cache_path(account, region, resourceType)
+    os.makedirs(os.path.dirname(pathName), exist_ok = True)
+    tempPath = f'{pathName}.{os.getpid()}.tmp'
+    with open(tempPath, mode = 'w') as file:
+        json.dump(entry, file, default = str)       #default = str stores the datetimes boto3 returns as text.
+    os.replace(tempPath, pathName)
+
+#Returns the day wildcards ('2024-06-03*') from the day of fetchedAt to today, the values of a creation-date or launch-time filter.
+#The day of the last fetch is included, items already stored are merged by ID.
+def days_since(fetchedAt):
+    day = datetime.fromtimestamp(fetchedAt, timezone.utc).date()
+    today = datetime.now(timezone.utc).date()
+    days = []
+    while day <= today:
+        days.append(f'{day.isoformat()}*')
+        day += timedelta(days = 1)
+    return days
+
+#Returns (items, full) for one resource type. fetchAll() downloads everything, fetchSince(days) what changed on those days.
+#full is True when the items were downloaded in full by this call.
+def refresh(account, region, resourceType, idKey, fetchAll, fetchSince):
+    now = time.time()
+    entry = load_entry(account, region, resourceType) if fullRefreshDays else None
+    if entry is None or now - entry['FullAt'] > fullRefreshDays * 86400 or now - entry['FetchedAt'] > maxDeltaDays * 86400:
+        items = list(fetchAll())
+        full = True
+        entry = {'FullAt': now}
+    else:
+        merged = {item[idKey]: item for item in entry['Items']}
+        merged.update((item[idKey], item) for item in fetchSince(days_since(entry['FetchedAt'])))
+        items = list(merged.values())
+        full = False
+    entry.update({'FetchedAt': now, 'Items': items})
+    if fullRefreshDays:
+        save_entry(account, region, resourceType, entry)
+    return items, full
+
+#Returns (images, full): every AMI owned by the account, and whether they were downloaded in full by this call.
+#Images created since the last run are fetched with the creation-date filter.
+def region_images(ec2, account, region):
+    return refresh(account, region, 'images', 'ImageId',
+                   lambda: iter_images(ec2),
+                   lambda days: paginate(ec2, 'describe_images', 'Images', Owners = ['self'], Filters = [{'Name': 'creation-date', 'Values': days}]))
+
+#Re-reads images that came from the store in batches and returns image ID -> current record for the ones that still exist.
+#The fresh records replace the stored ones, and the images that no longer exist are dropped from the store.
+def refresh_images(ec2, account, region, images):
+    records = image_records(ec2, [image['ImageId'] for image in images])
+    gone = {image['ImageId'] for image in images if image['ImageId'] not in records}
+    update_items(account, region, 'images', 'ImageId', records.values(), gone)
+    return records
+
+#Re-reads selected images that came from the store and returns the ones select(images) still picks out of the current records.
+#Tags and names can change after an image was stored, so the policy runs again on what EC2 returns now.
+def verify_images(ec2, account, region, selected, select):
+    records = refresh_images(ec2, account, region, selected)
+    return select([records[image['ImageId']] for image in selected if image['ImageId'] in records])
+
+#Returns the AMIs owned by the account that select(images) picks out, for example a compiled retention policy.
+#When the images come from the store, the selected ones are verified against their current records before they are returned.
+def cached_images(ec2, account, region, select):
+    images, full = region_images(ec2, account, region)
+    selected = select(images)       #The store holds every owned AMI, names and dates are matched locally.
+    if not full and selected:
+        selected = verify_images(ec2, account, region, selected, select)
+    return selected
+
+#Returns the active EC2 instances of the region. Instances launched or started since the last run are fetched with the launch-time filter.
+#Instances terminated since then stay in the store until the next full refresh, which only keeps their AMIs from being deleted.
+def cached_instances(ec2, account, region):
+    def instance_rows(instances):
+        return ({'InstanceId': instance['InstanceId'], 'ImageId': instance['ImageId'], 'State': instance['State']} for instance in instances)
+    instances, full = refresh(account, region, 'instances', 'InstanceId',
+                              lambda: instance_rows(iter_instances(ec2, activeStates)),
+                              lambda days: instance_rows(iter_instances(ec2, activeStates, [{'Name': 'launch-time', 'Values': days}])))
+    return [instance for instance in instances if instance['State']['Name'] in activeStates]
+
+#Replaces items of an entry with fresh records and drops the items whose IDs are in gone.
+def update_items(account, region, resourceType, idKey, fresh, gone):
+    entry = load_entry(account, region, resourceType)
+    if entry:
+        merged = {item[idKey]: item for item in entry['Items'] if item[idKey] not in gone}
+        merged.update((item[idKey], item) for item in fresh)
+        entry['Items'] = list(merged.values())
+        save_entry(account, region, resourceType, entry)
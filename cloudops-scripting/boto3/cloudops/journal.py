@@ -0,0 +1,99 @@
+#Append-only journal of finished work, so an interrupted deletion run can resume without replaying the calls it already made.
+#Each line is account,region,resource,outcome. Lines are fsynced in batches and a line cut short by a crash is ignored on the next load.
+#The csv log of a run is written a row at a time as the work finishes, so it holds every deletion the journal holds.
+
+import contextlib
+import csv
+import os
+import threading
+import time
+
+syncEvery = 50          #Number of entries written between fsyncs.
+syncInterval = 2.0      #Seconds after which pending entries are fsynced even if the batch is not full.
+
+journalLock = threading.Lock()
+journalFile = None      #Open journal file, set by open_journal().
+finished = set()        #(account, region, resource) entries that do not need to run again.
+finalOutcomes = set()   #Outcomes that mark an entry as finished, e.g. {'Success'}. Other outcomes are retried on the next run.
+unsynced = 0
+lastSync = 0.0
+
+#Loads the finished entries of an earlier run from the journal. Only complete lines count, a partial last line from a crash is skipped.
+def load_journal(pathName, outcomes):
+    entries = set()
+    if not os.path.exists(pathName):
+        return entries
+    with open(pathName, mode = 'r', newline = '') as file:
+        lines = file.read().split('\n')
+    for entry in csv.reader(lines[:-1]):       #The text after the last newline is either empty or an unfinished line.
+        if len(entry) == 4 and entry[3] in outcomes:
+            entries.add((entry[0], entry[1], entry[2]))
+    return entries
+
+#Checks if the file ends with a complete line.
+def ends_with_newline(pathName):
+    with open(pathName, mode = 'rb') as file:
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b'\n'
+
+#Opens the journal for appending and loads the entries finished by earlier runs. Returns the number of finished entries.
+def open_journal(pathName, outcomes = ('Success',)):
+    global journalFile, finished, finalOutcomes, lastSync
+    with journalLock:
+        finalOutcomes = set(outcomes)
+        finished = load_journal(pathName, finalOutcomes)
+        journalFile = open(pathName, mode = 'a', newline = '')
+        if journalFile.tell() > 0 and not ends_with_newline(pathName):
+            journalFile.write('\r\n')      #Ends a line cut short by a crash so the next entry starts on its own line.
+        lastSync = time.monotonic()
+    return len(finished)
+
+#Checks if an entry was finished by this run or an earlier one.
+def is_finished(account, region, resource):
+    return (str(account), region, resource) in finished
+
+#Appends an entry to the journal. The write is fsynced once a batch is full or the sync interval has passed.
+def record(account, region, resource, outcome):
+    global unsynced, lastSync
+    if journalFile is None:
+        return
+    with journalLock:
+        csv.writer(journalFile).writerow([account, region, resource, outcome])
+        if outcome in finalOutcomes:
+            finished.add((str(account), region, resource))
+        unsynced += 1
+        if unsynced >= syncEvery or time.monotonic() - lastSync >= syncInterval:
+            sync_journal()
+
+#Flushes and fsyncs pending entries. Called with journalLock held.
+def sync_journal():
+    global unsynced, lastSync
+    journalFile.flush()
+    os.fsync(journalFile.fileno())
+    unsynced = 0
+    lastSync = time.monotonic()
+
+#Syncs the remaining entries and closes the journal.
+def close_journal():
+    global journalFile
+    with journalLock:
+        if journalFile is not None:
+            sync_journal()
+            journalFile.close()
+            journalFile = None
+
+#Opens the csv log of a run for appending, for a with block, and writes the header to a new file. Yields write(rows).
+#Rows are written and flushed as soon as they are handed over, from any thread, so an interrupted run keeps the rows of the work it finished.
+@contextlib.contextmanager
+def open_log(pathName, header):
+    logLock = threading.Lock()
+    with open(pathName, mode = 'a', newline = '') as file:
+        writer = csv.writer(file, delimiter = ',')
+        if file.tell() == 0:
+            writer.writerow(header)       #Writes the header to the top of a new csv file.
+            file.flush()
+        def write(rows):
+            with logLock:
+                writer.writerows(rows)
+                file.flush()
+        yield write
@@ -0,0 +1,111 @@
+#Idempotent S3 lifecycle rule updates. A bucket's existing configuration is fetched, the rule is added to it or replaces the rule
+#with the same ID, and the configuration is only written when its content hash differs from what the bucket already has.
+#Buckets found to hold the rule are remembered in a local cache, so later runs skip them without a call until the entry expires
+#or the rule changes.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from botocore.exceptions import ClientError
+from cloudops.ratelimit import retry_throttled
+
+lifecycleCache = '.lifecycle_cache.json'    #File that stores the buckets known to hold a rule between runs.
+cacheTTL = 7 * 24 * 60 * 60                 #Seconds a bucket stays in the cache before it is checked again.
+
+cacheLock = threading.Lock()
+cache = None            #{account: {bucket: {'RuleHash': hash of the rule, 'CheckedAt': time}}}, loaded on first use.
+
+#Returns a hash of a json-serializable value that does not depend on key order.
+def content_hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys = True, default = str).encode()).hexdigest()
+
+#Loads the cache from disk, returns an empty cache if the file is missing or unreadable.
+def load_cache():
+    try:
+        with open(lifecycleCache, mode = 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+#Writes the cache to disk. Entries written by other processes are kept when they are newer, and the file is replaced in one step.
+def save_cache():
+    with cacheLock:
+        if cache is None:
+            return
+        for account, buckets in load_cache().items():
+            for bucket, entry in buckets.items():
+                known = cache.setdefault(account, {}).get(bucket)
+                if known is None or entry['CheckedAt'] > known['CheckedAt']:
+                    cache[account][bucket] = entry
+        tempPath = f'{lifecycleCache}.{os.getpid()}.tmp'
+        with open(tempPath, mode = 'w') as file:
+            json.dump(cache, file, sort_keys = True)
+        os.replace(tempPath, lifecycleCache)
+
+#Checks if the bucket was found to hold the rule recently.
+def is_cached(account, bucket, ruleHash):
+    global cache
+    with cacheLock:
+        if cache is None:
+            cache = load_cache()
+        entry = cache.get(str(account), {}).get(bucket)
+    return bool(entry) and entry['RuleHash'] == ruleHash and time.time() - entry['CheckedAt'] < cacheTTL
+
+#Records that the bucket holds the rule.
+def remember(account, bucket, ruleHash):
+    global cache
+    with cacheLock:
+        if cache is None:
+            cache = load_cache()
+        cache.setdefault(str(account), {})[bucket] = {'RuleHash': ruleHash, 'CheckedAt': time.time()}
+
+#Returns the bucket's lifecycle configuration without the response metadata, or None if the bucket has none.
+def get_lifecycle(s3Client, bucket):
+    try:
+        response = s3Client.get_bucket_lifecycle_configuration(Bucket = bucket)
+    except ClientError as lifecycleError:
+        if lifecycleError.response.get('Error', {}).get('Code') == 'NoSuchLifecycleConfiguration':
+            return None
+        raise
+    return {key: value for key, value in response.items() if key != 'ResponseMetadata'}
+
+#Returns the rules with rule added, or in place of the rule with the same ID. A rule given with the old top-level Prefix is moved
+#into a Filter when the other rules use Filters, S3 does not accept a configuration that mixes the two.
+def merge_rule(rules, rule):
+    if 'Prefix' in rule and any('Filter' in existing for existing in rules):
+        rule = {**{key: value for key, value in rule.items() if key != 'Prefix'}, 'Filter': {'Prefix': rule['Prefix']}}
+    merged = [rule if existing.get('ID') == rule['ID'] else existing for existing in rules]
+    if not any(existing.get('ID') == rule['ID'] for existing in rules):
+        merged.append(rule)
+    return merged
+
+#Checks the bucket's lifecycle configuration against rule without writing it. Returns (action, current configuration): action is
+#'cached' or 'unchanged' when the bucket holds the rule, 'skipped' when it has other rules and merge is False, or None when it needs the rule.
+def check_rule(s3Client, account, bucket, rule, merge = True):
+    ruleHash = content_hash(rule)
+    if is_cached(account, bucket, ruleHash):
+        return 'cached', None
+    current = get_lifecycle(s3Client, bucket)
+    rules = current['Rules'] if current else []
+    if current and content_hash(merge_rule(rules, rule)) == content_hash(rules):
+        remember(account, bucket, ruleHash)
+        return 'unchanged', current
+    if rules and not merge:
+        return 'skipped', current
+    return None, current
+
+#Makes sure the bucket holds rule and returns what was done: 'cached', 'unchanged', 'added', 'updated', or 'skipped' when the
+#bucket has other rules and merge is False. Without merge a bucket with no configuration gets one with just the rule.
+def apply_rule(s3Client, account, bucket, rule, merge = True):
+    action, current = check_rule(s3Client, account, bucket, rule, merge)
+    if action:
+        return action
+    rules = current['Rules'] if current else []
+    extra = {}
+    if current and 'TransitionDefaultMinimumObjectSize' in current:      #Kept, it would be reset to its default otherwise.
+        extra['TransitionDefaultMinimumObjectSize'] = current['TransitionDefaultMinimumObjectSize']
+    retry_throttled(s3Client.put_bucket_lifecycle_configuration, Bucket = bucket, LifecycleConfiguration = {'Rules': merge_rule(rules, rule)}, **extra)      #Rate controlled, throttled calls are retried before they count as failed.
+    remember(account, bucket, content_hash(rule))
+    return 'updated' if any(existing.get('ID') == rule['ID'] for existing in rules) else 'added'
@@ -0,0 +1,131 @@
+#Opt-in API call accounting. botocore event handlers on every pooled session record, per operation, account and region:
+#call count, latency histogram, retries, errors and throttling errors. A JSON summary is written when the run ends.
+#Turn it on with the CLOUDOPS_METRICS environment variable, for example: CLOUDOPS_METRICS=metrics.json python rdsinstances.py
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from cloudops import session
+from cloudops.ratelimit import throttleCodes
+
+metricsVariable = 'CLOUDOPS_METRICS'        #Environment variable holding the path of the JSON summary.
+latencyBuckets = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]      #Upper bounds of the latency histogram, in milliseconds.
+
+metricsLock = threading.Lock()
+operations = {}         #(service, operation, account, region) -> counters
+metricsPath = None      #Set by start_metrics() when metrics are turned on.
+runName = None
+runStart = None
+
+#Returns an empty set of counters for one (service, operation, account, region).
+def new_counters():
+    return {'calls': 0, 'errors': 0, 'throttles': 0, 'retries': 0, 'latencyMsTotal': 0.0, 'latencyMsMax': 0.0, 'histogram': [0] * (len(latencyBuckets) + 1)}
+
+#Records the start time of a call. Registered first so it runs before any handler that answers the call itself.
+def before_call(context, **kwargs):
+    context['metricsStart'] = time.perf_counter()
+
+#Records a finished call, including calls that returned an error response.
+def after_call(account, event_name, parsed, context, **kwargs):
+    errorCode = parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0) if isinstance(parsed, dict) else 0
+    record_call(account, event_name, context, errorCode, retries)
+
+#Records a call that failed without a response, for example a connection error after the retries ran out.
+def after_call_error(account, event_name, exception, context, **kwargs):
+    record_call(account, event_name, context, type(exception).__name__, 0)
+
+#Adds one call to the counters. The event name is 'after-call.<service>.<operation>'.
+def record_call(account, eventName, context, errorCode, retries):
+    latencyMs = (time.perf_counter() - context.get('metricsStart', time.perf_counter())) * 1000
+    eventType, service, operation = eventName.split('.', 2)
+    key = (service, operation, account, context.get('client_region') or 'default')
+    bucket = next((index for index, bound in enumerate(latencyBuckets) if latencyMs <= bound), len(latencyBuckets))
+    with metricsLock:
+        counters = operations.setdefault(key, new_counters())
+        counters['calls'] += 1
+        counters['retries'] += retries
+        counters['latencyMsTotal'] += latencyMs
+        counters['latencyMsMax'] = max(counters['latencyMsMax'], latencyMs)
+        counters['histogram'][bucket] += 1
+        if errorCode:
+            counters['errors'] += 1
+            if errorCode in throttleCodes:
+                counters['throttles'] += 1
+
+#Attaches the handlers to a new account session. Used as a cloudops.session hook.
+def attach_metrics(account, accountSession):
+    events = accountSession.events
+    events.register_first('before-call.*.*', before_call)
+    events.register('after-call.*.*', lambda **kwargs: after_call(account, **kwargs))
+    events.register('after-call-error.*.*', lambda **kwargs: after_call_error(account, **kwargs))
+
+#Turns metrics on when CLOUDOPS_METRICS is set. Call at the start of main(), before any account session is created.
+def start_metrics(name):
+    global metricsPath, runName, runStart
+    metricsPath = os.environ.get(metricsVariable)
+    if not metricsPath:
+        return False
+    runName = name
+    runStart = time.perf_counter()
+    with metricsLock:
+        operations.clear()
+    if attach_metrics not in session.sessionHooks:
+        session.sessionHooks.append(attach_metrics)
+    return True
+
+#Writes the raw counters to pathName, for a worker process whose calls are summarized by the process that started it.
+def save_counters(pathName):
+    with metricsLock:
+        saved = [[list(key), counters] for key, counters in operations.items()]
+    with open(pathName, mode = 'w') as file:
+        json.dump(saved, file)
+
+#Adds the counters saved by a worker process to this process's counters and removes the file. A worker that saved nothing is skipped.
+def merge_counters(pathName):
+    try:
+        with open(pathName, mode = 'r') as file:
+            saved = json.load(file)
+    except (OSError, ValueError):
+        return
+    with metricsLock:
+        for key, workerCounters in saved:
+            counters = operations.setdefault(tuple(key), new_counters())
+            for name in ('calls', 'errors', 'throttles', 'retries', 'latencyMsTotal'):
+                counters[name] += workerCounters[name]
+            counters['latencyMsMax'] = max(counters['latencyMsMax'], workerCounters['latencyMsMax'])
+            counters['histogram'] = [count + workerCount for count, workerCount in zip(counters['histogram'], workerCounters['histogram'])]
+    os.remove(pathName)
+
+#Builds the summary: one entry per (service, operation, account, region) plus totals per operation.
+def summary():
+    histogramLabels = [f'<={bound}ms' for bound in latencyBuckets] + [f'>{latencyBuckets[-1]}ms']
+    entries = []
+    totals = {}
+    with metricsLock:
+        for (service, operation, account, region), counters in sorted(operations.items()):
+            entry = {'service': service, 'operation': operation, 'account': account, 'region': region}
+            entry.update({name: counters[name] for name in ('calls', 'errors', 'throttles', 'retries')})
+            entry['latencyMs'] = {'total': round(counters['latencyMsTotal'], 1), 'mean': round(counters['latencyMsTotal'] / counters['calls'], 1),
+                                  'max': round(counters['latencyMsMax'], 1), 'histogram': dict(zip(histogramLabels, counters['histogram']))}
+            entries.append(entry)
+            total = totals.setdefault(f'{service}.{operation}', {'calls': 0, 'errors': 0, 'throttles': 0, 'retries': 0, 'latencyMsTotal': 0.0})
+            for name in ('calls', 'errors', 'throttles', 'retries'):
+                total[name] += counters[name]
+            total['latencyMsTotal'] = round(total['latencyMsTotal'] + counters['latencyMsTotal'], 1)
+    return {'script': runName, 'finishedAt': datetime.now(timezone.utc).isoformat(), 'wallSeconds': round(time.perf_counter() - runStart, 3),
+            'totals': dict(sorted(totals.items(), key = lambda item: -item[1]['latencyMsTotal'])), 'operations': entries}
+
+#Writes the JSON summary if metrics are on. Call at the end of main().
+def write_metrics():
+    global metricsPath
+    if not metricsPath:
+        return
+    with open(metricsPath, mode = 'w') as file:
+        json.dump(summary(), file, indent = 1)
+    print(f"API call metrics written to {metricsPath}")
+    if attach_metrics in session.sessionHooks:
+        session.sessionHooks.remove(attach_metrics)
+    metricsPath = None
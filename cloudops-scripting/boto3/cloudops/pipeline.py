@@ -0,0 +1,52 @@
+#Runs work as a chain of stages connected by bounded queues. Every stage has its own pool of threads, so network-bound stages
+#overlap: the next region is being listed while the AMIs of the previous one are still being deregistered.
+#The bounded queues keep memory flat, a fast stage waits when the stage after it falls behind.
+
+import queue
+import threading
+
+stageDone = object()        #Put on a stage's queue once per worker when the stage before it has finished.
+
+#Runs every item of source through stages, a list of (name, worker, maxWorkers). worker(item) returns or yields the items
+#passed to the next stage, an empty result drops the item. Returns (outputs of the last stage, failures).
+#Outputs are in the same order as a serial run. failures is a list of (stage name, item, error) for items whose worker raised.
+def run_pipeline(source, stages, queueSize):
+    inboxes = [queue.Queue(maxsize = queueSize) for stage in stages]
+    outputs = []
+    failures = []
+    resultLock = threading.Lock()
+
+    def run_stage(index, name, worker):
+        while True:
+            entry = inboxes[index].get()
+            if entry is stageDone:
+                return
+            sequence, item = entry
+            try:
+                for position, result in enumerate(worker(item) or []):
+                    if index + 1 < len(stages):
+                        inboxes[index + 1].put((sequence + (position,), result))
+                    else:
+                        with resultLock:
+                            outputs.append((sequence + (position,), result))
+            except Exception as stageError:
+                with resultLock:
+                    failures.append((name, item, stageError))
+
+    pools = []
+    for index, (name, worker, maxWorkers) in enumerate(stages):
+        pool = [threading.Thread(target = run_stage, args = (index, name, worker), daemon = True) for thread in range(maxWorkers)]
+        for thread in pool:
+            thread.start()
+        pools.append(pool)
+    try:
+        for position, item in enumerate(source):
+            inboxes[0].put(((position,), item))
+    finally:
+        for index, pool in enumerate(pools):        #Stages are closed front to back, each one after every item has left the stage before it.
+            for thread in pool:
+                inboxes[index].put(stageDone)
+            for thread in pool:
+                thread.join()
+    outputs.sort(key = lambda entry: entry[0])
+    return [result for sequence, result in outputs], failures
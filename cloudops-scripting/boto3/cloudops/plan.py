@@ -0,0 +1,78 @@
+#Deletion plans. In plan mode a script only discovers what it would delete and writes one record per action to a plan file.
+#In execute mode it reads the plan back, or one shard of it, and carries out the actions without repeating the discovery calls.
+#Plans are csv files, gzip compressed when the file name ends in .gz, and are read one record at a time.
+
+import argparse
+import csv
+import gzip
+import zlib
+from collections import namedtuple
+
+#One planned action. ResourceIds holds the resource the action is for first, then the resources that go with it,
+#for example an AMI followed by its snapshots. Detail is carried through to the report, for example the snapshot owner, or the
+#report fields of an AMI as JSON.
+PlanRecord = namedtuple('PlanRecord', ['Account', 'Region', 'Action', 'ResourceIds', 'Cost', 'Detail'])
+
+#Opens a plan file for reading ('r') or writing ('w').
+def open_plan(pathName, mode):
+    if pathName.endswith('.gz'):
+        return gzip.open(pathName, mode = mode + 't', newline = '')
+    return open(pathName, mode = mode, newline = '')
+
+#Streams plan records into a new plan file and returns the number written.
+def write_plan(pathName, records):
+    count = 0
+    with open_plan(pathName, 'w') as file:
+        writer = csv.writer(file)
+        writer.writerow(PlanRecord._fields)
+        for record in records:
+            writer.writerow(record._replace(ResourceIds = ' '.join(record.ResourceIds)))
+            count += 1
+    return count
+
+#Parses a shard given as INDEX/COUNT, for example 0/4 for the first of four shards.
+def parse_shard(text):
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must look like INDEX/COUNT, for example 0/4, not {text}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be from 0 to {count - 1}")
+    return index, count
+
+#Returns the shard an (account, region) belongs to. Every action of a region lands in the same shard, so an AMI and the
+#snapshots that depend on it are never split across hosts. crc32 is used because it is the same on every host and run.
+def shard_of(account, region, count):
+    return zlib.crc32(f'{account}:{region}'.encode()) % count
+
+#Streams the records of a plan file, only the ones in shard (INDEX, COUNT) when a shard is given.
+def read_plan(pathName, shard = None):
+    with open_plan(pathName, 'r') as file:
+        reader = csv.reader(file)
+        next(reader)        #Header row.
+        for line in reader:
+            if not line:
+                continue
+            record = PlanRecord(*line)
+            if shard and shard_of(record.Account, record.Region, shard[1]) != shard[0]:
+                continue
+            yield record._replace(ResourceIds = record.ResourceIds.split())
+
+#Groups plan records by account and region: {account: {region: [PlanRecord, ...]}}, in plan order.
+def group_plan(records):
+    grouped = {}
+    for record in records:
+        grouped.setdefault(record.Account, {}).setdefault(record.Region, []).append(record)
+    return grouped
+
+#Adds the plan and execute options to a script's argument parser and parses the arguments.
+#Without either option the script discovers and deletes in one pass, as before.
+def parse_plan_args(parser, argv = None):
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--plan', metavar = 'PLANFILE', help = 'only discover what would be deleted and write it to PLANFILE (.gz to compress)')
+    mode.add_argument('--execute', metavar = 'PLANFILE', help = 'carry out the actions in PLANFILE instead of discovering them')
+    parser.add_argument('--shard', type = parse_shard, metavar = 'INDEX/COUNT', help = 'with --execute, only carry out shard INDEX of COUNT, for example 0/4')
+    args = parser.parse_args(argv)
+    if args.shard and not args.execute:
+        parser.error('--shard can only be used with --execute')
+    return args
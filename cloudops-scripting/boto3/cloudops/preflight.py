@@ -0,0 +1,79 @@
+#Pre-flight check of the managed accounts. Before any work starts, the role in every account is validated in parallel with one
+#describe_regions call, made with short timeouts and no retries so an unreachable account cannot hold the others up.
+#Each result, ok, denied or timeout, is cached on disk for a while, and the region list the call returns is saved to the region catalog.
+#The work then only starts on accounts known to be reachable.
+
+import json
+import os
+import threading
+import time
+from botocore.config import Config
+from botocore.exceptions import ConnectTimeoutError, ReadTimeoutError, EndpointConnectionError, ConnectionClosedError
+from cloudops.fanout import fan_out
+from cloudops.regions import refresh_regions
+from cloudops.session import new_client
+
+preflightCache = '.preflight_cache.json'      #File that stores the results between runs.
+statusTTL = {'ok': 60 * 60, 'denied': 15 * 60, 'timeout': 5 * 60}      #Seconds a result stays valid, failures are checked again sooner.
+validationTimeout = 10                  #Seconds to connect and to read before an account counts as timed out.
+validationWorkers = 32                  #Number of accounts validated at the same time.
+validationConfig = Config(connect_timeout = validationTimeout, read_timeout = validationTimeout, retries = {'mode': 'standard', 'total_max_attempts': 1})
+timeoutErrors = (ConnectTimeoutError, ReadTimeoutError, EndpointConnectionError, ConnectionClosedError)
+
+cacheLock = threading.Lock()
+
+#Loads the cached results, returns an empty cache if the file is missing or unreadable.
+def load_results():
+    try:
+        with open(preflightCache, mode = 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+#Adds results to the cache file. The file is replaced in one step so a crash never leaves a partial cache.
+def save_results(results):
+    with cacheLock:
+        cached = load_results()
+        cached.update(results)
+        tempPath = f'{preflightCache}.{os.getpid()}.tmp'
+        with open(tempPath, mode = 'w') as file:
+            json.dump(cached, file, indent = 1, sort_keys = True)
+        os.replace(tempPath, preflightCache)
+
+#Validates the role in one account and returns its result: {'Status': ok, denied or timeout, 'Detail': the error, 'CheckedAt': time}.
+def validate_account(account):
+    try:
+        refresh_regions(account, new_client(account, 'ec2', config = validationConfig))     #The enabled regions are saved to the shared region catalog.
+        status, detail = 'ok', ''
+    except timeoutErrors as timeoutError:
+        status, detail = 'timeout', str(timeoutError)
+    except Exception as validationError:
+        status, detail = 'denied', str(validationError)
+    return {'Status': status, 'Detail': detail, 'CheckedAt': time.time()}
+
+#Validates every account, reusing cached results that are still fresh, and returns {account: result}. Prints the accounts that failed.
+def preflight(accounts):
+    accounts = [str(account) for account in accounts]
+    cached = load_results()
+    results = {}
+    stale = []
+    for account in accounts:
+        entry = cached.get(account)
+        if entry and time.time() - entry['CheckedAt'] < statusTTL.get(entry['Status'], 0):
+            results[account] = entry
+        else:
+            stale.append(account)
+    checked = {account: result for account, result, accountError in fan_out(stale, validate_account, validationWorkers)}
+    if checked:
+        save_results(checked)
+    results.update(checked)
+    for account in accounts:
+        if results[account]['Status'] != 'ok':
+            print(f"Pre-flight: account {account} is {results[account]['Status']}: {results[account]['Detail']}")
+    reachable = sum(1 for account in accounts if results[account]['Status'] == 'ok')
+    print(f"Pre-flight: {reachable} of {len(accounts)} accounts reachable, {len(checked)} validated and {len(accounts) - len(checked)} from the cache.")
+    return results
+
+#Checks if the pre-flight results mark the account as reachable.
+def account_ok(results, account):
+    return results.get(str(account), {}).get('Status') == 'ok'
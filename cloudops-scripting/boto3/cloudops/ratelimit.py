@@ -0,0 +1,104 @@
+#Shared rate control for mutating API calls. Every (account, region, API class) has a token bucket that all threads draw from.
+#The bucket rate adapts: a throttling error halves it, every successful call raises it a little, up to the class maximum.
+#Throttled calls made through retry_throttled() are retried with jittered backoff before the error reaches the script.
+
+import random
+import threading
+import time
+from botocore.exceptions import ClientError
+
+#Error codes AWS services use for throttling.
+throttleCodes = {'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException', 'TooManyRequestsException',
+                 'RequestLimitExceeded', 'RequestThrottled', 'SlowDown', 'PriorRequestNotComplete', 'ProvisionedThroughputExceededException'}
+
+#Operations under rate control and the API class whose bucket they draw from. Calls not listed here are never delayed.
+apiClasses = {
+    'ec2.DeleteSnapshot': 'ec2-mutating',
+    'ec2.DeregisterImage': 'ec2-mutating',
+    's3.PutBucketLifecycleConfiguration': 's3-bucket-config',
+}
+#Starting rate and burst of each API class, and the range the adaptive rate moves in, in calls per second.
+classLimits = {
+    'ec2-mutating': {'rate': 5.0, 'burst': 20, 'minRate': 0.5, 'maxRate': 20.0},
+    's3-bucket-config': {'rate': 10.0, 'burst': 10, 'minRate': 1.0, 'maxRate': 50.0},
+}
+rateIncrease = 0.1          #Calls per second added to the rate after every successful call.
+rateDecrease = 0.5          #Factor the rate is multiplied by after a throttling error.
+decreaseInterval = 1.0      #Seconds between two rate decreases, so a burst of throttled calls in flight only counts once.
+retryAttempts = 5           #Retries of a throttled call before the error is returned to the script.
+retryBase = 0.5             #Seconds of the first backoff, doubled on every retry.
+retryCap = 20.0             #Longest backoff between two retries, in seconds.
+
+bucketLock = threading.Lock()
+buckets = {}                #(account, region, API class) -> token bucket
+
+#Returns the token bucket of (account, region, API class), creating it full. Called with bucketLock held.
+def get_bucket(key):
+    if key not in buckets:
+        limits = classLimits[key[2]]
+        buckets[key] = {'rate': limits['rate'], 'tokens': float(limits['burst']), 'updated': time.monotonic(), 'lastDecrease': 0.0}
+    return buckets[key]
+
+#Waits until the bucket has a token and takes it.
+def acquire(key):
+    while True:
+        with bucketLock:
+            bucket = get_bucket(key)
+            now = time.monotonic()
+            bucket['tokens'] = min(classLimits[key[2]]['burst'], bucket['tokens'] + (now - bucket['updated']) * bucket['rate'])
+            bucket['updated'] = now
+            if bucket['tokens'] >= 1:
+                bucket['tokens'] -= 1
+                return
+            wait = (1 - bucket['tokens']) / bucket['rate']
+        time.sleep(wait)
+
+#Adjusts the bucket rate after a call: down on a throttling error, up otherwise.
+def adjust_rate(key, throttled):
+    limits = classLimits[key[2]]
+    with bucketLock:
+        bucket = get_bucket(key)
+        now = time.monotonic()
+        if not throttled:
+            bucket['rate'] = min(limits['maxRate'], bucket['rate'] + rateIncrease)
+        elif now - bucket['lastDecrease'] >= decreaseInterval:
+            bucket['rate'] = max(limits['minRate'], bucket['rate'] * rateDecrease)
+            bucket['tokens'] = min(bucket['tokens'], 0.0)        #Spent tokens are not refunded, the next call waits for the slower refill.
+            bucket['lastDecrease'] = now
+
+#Returns the bucket key of a call, or None if the operation is not under rate control. event_name is '<event>.<service>.<operation>'.
+def bucket_key(account, event_name, context):
+    apiClass = apiClasses.get(event_name.split('.', 1)[1])
+    if apiClass is None:
+        return None
+    return (account, context.get('client_region') or 'default', apiClass)
+
+#Takes a token before a rate controlled call is sent.
+def before_call(account, event_name, context, **kwargs):
+    key = bucket_key(account, event_name, context)
+    if key:
+        acquire(key)
+
+#Feeds the outcome of a rate controlled call back into its bucket.
+def after_call(account, event_name, parsed, context, **kwargs):
+    key = bucket_key(account, event_name, context)
+    if key:
+        errorCode = parsed.get('Error', {}).get('Code') if isinstance(parsed, dict) else None
+        adjust_rate(key, errorCode in throttleCodes)
+
+#Attaches the rate control handlers to a new account session. Called by cloudops.session for every account.
+def attach_limits(account, accountSession):
+    events = accountSession.events
+    events.register_first('before-call.*.*', lambda **kwargs: before_call(account, **kwargs))
+    events.register('after-call.*.*', lambda **kwargs: after_call(account, **kwargs))
+
+#Calls method(**params) and retries it with jittered exponential backoff while it fails with a throttling error.
+#Any other error, or a throttling error after the last retry, is raised to the caller.
+def retry_throttled(method, **params):
+    for attempt in range(retryAttempts + 1):
+        try:
+            return method(**params)
+        except ClientError as callError:
+            if callError.response.get('Error', {}).get('Code') not in throttleCodes or attempt == retryAttempts:
+                raise
+            time.sleep(random.uniform(0, min(retryCap, retryBase * 2 ** attempt)))
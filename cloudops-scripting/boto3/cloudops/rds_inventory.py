@@ -0,0 +1,37 @@
+#RDS fleet inventory. One pass over describe_db_instances and describe_db_clusters per region collects every attribute the reports
+#use into one wide row per DB instance or cluster. Narrow reports, such as the MultiAZ list, are views over these rows instead of new scans.
+#Rows are lists in inventoryColumns order, so they can be written to csv directly or passed between processes as json.
+
+from cloudops.inventory import iter_db_instances, iter_db_clusters
+
+inventoryColumns = ['Account', 'Region', 'ResourceType', 'Identifier', 'Engine', 'EngineVersion', 'Class', 'Status', 'MultiAZ', 'StorageType',
+                    'AllocatedStorage', 'StorageEncrypted', 'BackupRetentionPeriod', 'AvailabilityZone', 'ClusterIdentifier', 'ClusterMembers', 'CreateTime']
+
+#Returns the inventory row of a DB instance.
+def instance_row(account, region, db):
+    return [str(account), region, 'instance', db['DBInstanceIdentifier'], db.get('Engine', ''), db.get('EngineVersion', ''), db.get('DBInstanceClass', ''),
+            db.get('DBInstanceStatus', ''), db.get('MultiAZ', False), db.get('StorageType', ''), db.get('AllocatedStorage', ''), db.get('StorageEncrypted', ''),
+            db.get('BackupRetentionPeriod', ''), db.get('AvailabilityZone', ''), db.get('DBClusterIdentifier', ''), '', str(db.get('InstanceCreateTime', ''))]
+
+#Returns the inventory row of a DB cluster. Its members are listed by instance identifier, the writer first.
+def cluster_row(account, region, cluster):
+    members = sorted(cluster.get('DBClusterMembers', []), key = lambda member: not member.get('IsClusterWriter'))
+    return [str(account), region, 'cluster', cluster['DBClusterIdentifier'], cluster.get('Engine', ''), cluster.get('EngineVersion', ''), cluster.get('DBClusterInstanceClass', ''),
+            cluster.get('Status', ''), cluster.get('MultiAZ', False), cluster.get('StorageType', ''), cluster.get('AllocatedStorage', ''), cluster.get('StorageEncrypted', ''),
+            cluster.get('BackupRetentionPeriod', ''), ' '.join(cluster.get('AvailabilityZones', [])), cluster['DBClusterIdentifier'],
+            ' '.join(member['DBInstanceIdentifier'] for member in members), str(cluster.get('ClusterCreateTime', ''))]
+
+#Returns the inventory rows of listed DB instances, then of listed DB clusters.
+def inventory_rows(account, region, dbInstances, dbClusters):
+    rows = [instance_row(account, region, db) for db in dbInstances]
+    rows.extend(cluster_row(account, region, cluster) for cluster in dbClusters)
+    return rows
+
+#Returns the inventory rows of one region: its DB instances, then its DB clusters. Both calls follow every page.
+def region_inventory(account, region, rds):
+    return inventory_rows(account, region, iter_db_instances(rds), iter_db_clusters(rds))
+
+#The MultiAZ view: [identifier, MultiAZ] of the DB instances that are MultiAZ.
+def multiAZ_rows(rows):
+    typeColumn, idColumn, multiAzColumn = (inventoryColumns.index(column) for column in ('ResourceType', 'Identifier', 'MultiAZ'))
+    return [[row[idColumn], row[multiAzColumn]] for row in rows if row[typeColumn] == 'instance' and row[multiAzColumn] == True]
@@ -0,0 +1,28 @@
+#Index of the AWS Backup recovery points of EC2 images, built once per (account, region).
+
+from cloudops.inventory import iter_backup_vaults, iter_recovery_points
+
+#Returns the image ID from an EC2 recovery point ARN, for example arn:aws:ec2:us-east-1::image/ami-0123 -> ami-0123.
+def recovery_point_image(recoveryPointArn):
+    return recoveryPointArn.rsplit('/', 1)[-1]
+
+#Builds image ID -> (vault name, recovery point ARN) from paginated listings of every vault in the region.
+def recovery_point_index(backup):
+    index = {}
+    for vault in iter_backup_vaults(backup):
+        vaultName = vault['BackupVaultName']
+        for recoveryPoint in iter_recovery_points(backup, vaultName, 'EC2'):
+            index[recovery_point_image(recoveryPoint['RecoveryPointArn'])] = (vaultName, recoveryPoint['RecoveryPointArn'])
+    return index
+
+#Groups the recovery points of the given images by vault so they can be deleted one vault at a time. Images without a recovery point are returned separately.
+def recovery_points_by_vault(index, imageIds):
+    byVault = {}
+    missing = []
+    for imageId in imageIds:
+        if imageId in index:
+            vaultName, recoveryPointArn = index[imageId]
+            byVault.setdefault(vaultName, []).append((imageId, recoveryPointArn))
+        else:
+            missing.append(imageId)
+    return byVault, missing
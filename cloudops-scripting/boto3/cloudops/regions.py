@@ -0,0 +1,58 @@
+#Per-account catalog of enabled regions. The catalog is cached on disk so every script reuses it and describe_regions is only called once per account per TTL.
+
+import json
+import os
+import threading
+import time
+from cloudops.session import get_client
+
+regionCache = '.region_cache.json'      #File that stores the region catalog between runs.
+cacheTTL = 24 * 60 * 60                 #Number of seconds a cached region list stays valid.
+enabledStatus = ['opt-in-not-required', 'opted-in']     #Opt-in statuses of regions that can be contacted.
+
+cacheLock = threading.Lock()
+catalog = None          #Loaded from regionCache the first time a region list is needed.
+
+#Loads the catalog from disk, returns an empty catalog if the file is missing or unreadable.
+def load_catalog():
+    try:
+        with open(regionCache, mode = 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+#Writes the catalog to disk. Entries written by other processes are kept when they are newer, and the file is replaced in one step so a crash never leaves a partial cache.
+def save_catalog():
+    global catalog
+    for account, entry in load_catalog().items():
+        if account not in catalog or entry['FetchedAt'] > catalog[account]['FetchedAt']:
+            catalog[account] = entry
+    tempPath = f'{regionCache}.{os.getpid()}.tmp'
+    with open(tempPath, mode = 'w') as file:
+        json.dump(catalog, file, indent = 1, sort_keys = True)
+    os.replace(tempPath, regionCache)
+
+#Calls describe_regions for the account and stores the enabled regions in the catalog. Also serves as a check that the role can authenticate.
+#ec2 is the client to call with, the account's pooled client by default.
+def refresh_regions(account, ec2 = None):
+    global catalog
+    ec2 = ec2 or get_client(account, 'ec2')
+    response = ec2.describe_regions(AllRegions = True)     #AllRegions also returns disabled regions so their opt-in status can be recorded.
+    regions = sorted(region['RegionName'] for region in response['Regions'] if region['OptInStatus'] in enabledStatus)
+    with cacheLock:
+        if catalog is None:
+            catalog = load_catalog()
+        catalog[str(account)] = {'FetchedAt': time.time(), 'Regions': regions}
+        save_catalog()
+    return regions
+
+#Return all enabled regions of the account, from the cache when it is still fresh. Disabled (not opted-in) regions are never returned.
+def get_all_regions(account):
+    global catalog
+    with cacheLock:
+        if catalog is None:
+            catalog = load_catalog()
+        entry = catalog.get(str(account))
+    if entry and time.time() - entry['FetchedAt'] < cacheTTL:
+        return list(entry['Regions'])
+    return refresh_regions(account)
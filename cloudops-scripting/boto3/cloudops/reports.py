@@ -0,0 +1,112 @@
+#Report writer shared by the scripts. Workers hand their rows to a report and carry on, one writer thread per report takes them off a
+#bounded queue and writes them in batches, so the scans never wait on file I/O and many threads can feed the same file.
+#A report has a fixed schema. It is written either as one file per account, or as a single consolidated file for the whole run
+#with the account in a column. Files are csv or JSON lines, gzip compressed when the format ends in .gz.
+
+import contextlib
+import csv
+import gzip
+import json
+import queue
+import threading
+
+reportFormats = {'csv': '.csv', 'csv.gz': '.csv.gz', 'jsonl': '.jsonl', 'jsonl.gz': '.jsonl.gz'}
+consolidatedPrefix = 'all'      #Prefix of a consolidated report's file name, in place of the account number.
+batchRows = 1000                #Most rows written in one batch.
+queueSize = 100                 #Row lists waiting for the writer, a worker waits when the writer falls behind.
+reportDone = object()           #Put on a report's queue when the report is closed.
+
+#Returns the file name of a report: the account number, or consolidatedPrefix, then the report suffix with the extension of the format.
+def report_path(report, account = None):
+    suffix = report['suffix'][:-len('.csv')] if report['suffix'].endswith('.csv') else report['suffix']
+    return f"{consolidatedPrefix if report['consolidated'] else account}{suffix}{reportFormats[report['format']]}"
+
+#Opens a report file and writes the csv header. Returns (file, write(rows)).
+def open_output(report, pathName):
+    if report['format'].endswith('.gz'):
+        file = gzip.open(pathName, mode = 'wt', newline = '')
+    else:
+        file = open(pathName, mode = 'w', newline = '')
+    columns = report['columns']
+    if report['format'].startswith('jsonl'):
+        def write(rows):
+            file.write(''.join(json.dumps(dict(zip(columns, row)), default = str) + '\n' for row in rows))
+    else:
+        writer = csv.writer(file, delimiter=',')
+        writer.writerow(columns)
+        write = writer.writerows
+    return file, write
+
+#Writer thread of a report. Takes row lists off the queue and writes whatever is waiting, up to batchRows rows, in one go.
+#After a write error the remaining rows are drained and dropped so the workers are never left waiting, the error is raised when the report is closed.
+def write_report(report):
+    outputs = {}            #account (None when consolidated) -> (file, write)
+    while True:
+        entries = [report['queue'].get()]
+        count = len(entries[0][1]) if entries[0] is not reportDone else 0
+        while count < batchRows and entries[-1] is not reportDone:
+            try:
+                entries.append(report['queue'].get_nowait())
+            except queue.Empty:
+                break
+            if entries[-1] is not reportDone:
+                count += len(entries[-1][1])
+        for entry in entries:
+            if entry is reportDone:
+                for file, write in outputs.values():
+                    file.close()
+                return
+            account, rows, last = entry
+            if report['error']:
+                continue
+            try:
+                key = None if report['consolidated'] else account
+                if key not in outputs:
+                    outputs[key] = open_output(report, report_path(report, account))
+                if rows:
+                    outputs[key][1](rows)
+                if last and not report['consolidated']:
+                    outputs.pop(key)[0].close()
+            except Exception as writeError:
+                report['error'] = writeError
+
+#Opens a report for a with block. suffix is the per-account file name after the account number, for example '_multiAZ_rds.csv'.
+#columns is the schema of a row. A consolidated report adds an 'Account' column in front, unless accountColumn names a column
+#of the schema that already holds the account. Leaving the block writes the rows still waiting, closes the files and raises the first write error.
+@contextlib.contextmanager
+def open_report(suffix, columns, consolidated = False, fileFormat = 'csv', accountColumn = None):
+    if fileFormat not in reportFormats:
+        raise ValueError(f"Unknown report format {fileFormat}, use one of {', '.join(reportFormats)}")
+    addAccount = consolidated and accountColumn is None
+    report = {'suffix': suffix, 'columns': (['Account'] if addAccount else []) + list(columns), 'width': len(columns), 'addAccount': addAccount,
+              'consolidated': consolidated, 'format': fileFormat, 'queue': queue.Queue(maxsize = queueSize), 'error': None}
+    report['thread'] = threading.Thread(target = write_report, args = (report,), daemon = True)
+    report['thread'].start()
+    try:
+        yield report
+    finally:
+        report['queue'].put(reportDone)
+        report['thread'].join()
+    if report['error']:
+        raise report['error']
+
+#Hands rows of an account to the report. Rows must match the schema the report was opened with.
+#With last the account's file is finished, an account that has no rows still gets a file with just the header.
+def add_rows(report, account, rows, last = False):
+    rows = list(rows)
+    for row in rows:
+        if len(row) != report['width']:
+            raise ValueError(f"Row {row} does not match the {report['width']} columns of the report {report['suffix']}")
+    if report['addAccount']:
+        rows = [[str(account)] + list(row) for row in rows]
+    report['queue'].put((str(account), rows, last))
+
+#Finishes an account's part of the report.
+def end_account(report, account, rows = ()):
+    add_rows(report, account, rows, True)
+
+#Adds the report options to a script's argument parser.
+def add_report_arguments(parser):
+    parser.add_argument('--consolidated', action = 'store_true', help = f'write one report for all accounts ({consolidatedPrefix}_...) with the account in a column, instead of one per account')
+    parser.add_argument('--report-format', choices = list(reportFormats), default = 'csv', help = 'file format of the reports, .gz formats are gzip compressed')
+    return parser
@@ -0,0 +1,92 @@
+#Retention policies. What the scripts may delete is declared in retention_policy.json instead of in each script.
+#The file has a 'defaults' section and a section per script under 'policies', a script's section is laid over the defaults.
+#Rules of a section, every one optional:
+#   olderThanDays   only images created more than this many days ago
+#   nameContains    only images with one of these words in the name, case insensitive
+#   nameExcludes    never images with one of these words in the name, case insensitive
+#   requireTags     only images with all of these tags, {"Key": "Value"} or {"Key": "*"} for any value
+#   keepTags        never images with one of these tags, same form as requireTags
+#   keepImages      never these image IDs
+#   onlyAccounts    only these accounts, an empty list allows every account
+#   skipAccounts    never these accounts
+#A policy is compiled once into a chain of filters that each run over a whole region's image list, cheapest first.
+#Creation dates are ISO 8601 text in UTC, so they are compared as text against a cutoff worked out once, no date is parsed per image.
+
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+policyFile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'retention_policy.json')     #Kept next to the scripts.
+ruleNames = {'olderThanDays', 'nameContains', 'nameExcludes', 'requireTags', 'keepTags', 'keepImages', 'onlyAccounts', 'skipAccounts'}
+
+#A compiled policy. Filters is the list of functions that each take and return a list of images.
+Policy = namedtuple('Policy', ['Name', 'Filters', 'OnlyAccounts', 'SkipAccounts'])
+
+policyLock = threading.Lock()
+policies = {}               #(script name, policy file) -> compiled policy
+
+#Returns the compiled policy of a script, reading the policy file on first use.
+def load_policy(name, pathName = None):
+    pathName = pathName or policyFile
+    with policyLock:
+        if (name, pathName) not in policies:
+            with open(pathName, mode = 'r') as file:
+                document = json.load(file)
+            rules = {**document.get('defaults', {}), **document.get('policies', {}).get(name, {})}
+            policies[(name, pathName)] = compile_policy(name, rules)
+        return policies[(name, pathName)]
+
+#Builds one case insensitive pattern that matches any of the words.
+def word_pattern(words):
+    return re.compile('|'.join(re.escape(word) for word in words), re.IGNORECASE)
+
+#Returns a test of an image's tags against {"Key": "Value" or "*"}: all of the tags must match with requireAll, any of them otherwise.
+def tag_test(tagRules, requireAll):
+    def test(image):
+        tags = {tag['Key']: tag['Value'] for tag in image.get('Tags', [])}
+        matches = (key in tags and value in ('*', tags[key]) for key, value in tagRules.items())
+        return all(matches) if requireAll else any(matches)
+    return test
+
+#Compiles the rules of one policy section. Unknown rules are an error, a misspelt rule must not quietly widen what is deleted.
+def compile_policy(name, rules):
+    unknown = set(rules) - ruleNames
+    if unknown:
+        raise ValueError(f"Unknown retention rules in policy {name}: {', '.join(sorted(unknown))}")
+    filters = []
+    if rules.get('olderThanDays') is not None:
+        #An image is old once a full olderThanDays days have passed, as (now - created).days > olderThanDays.
+        cutoff = (datetime.now(timezone.utc) - timedelta(days = rules['olderThanDays'] + 1)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        filters.append(lambda images: [image for image in images if image['CreationDate'] <= cutoff])
+    if rules.get('keepImages'):
+        keepImages = set(rules['keepImages'])
+        filters.append(lambda images: [image for image in images if image['ImageId'] not in keepImages])
+    if rules.get('nameContains'):
+        contains = word_pattern(rules['nameContains'])
+        filters.append(lambda images: [image for image in images if contains.search(image['Name'])])
+    if rules.get('nameExcludes'):
+        excludes = word_pattern(rules['nameExcludes'])
+        filters.append(lambda images: [image for image in images if not excludes.search(image['Name'])])
+    if rules.get('requireTags'):
+        required = tag_test(rules['requireTags'], True)
+        filters.append(lambda images: [image for image in images if required(image)])
+    if rules.get('keepTags'):
+        kept = tag_test(rules['keepTags'], False)
+        filters.append(lambda images: [image for image in images if not kept(image)])
+    return Policy(name, filters, {str(account) for account in rules.get('onlyAccounts', [])}, {str(account) for account in rules.get('skipAccounts', [])})
+
+#Returns the images the policy selects, in their original order.
+def select_images(policy, images):
+    for imageFilter in policy.Filters:
+        if not images:
+            break
+        images = imageFilter(images)
+    return list(images)
+
+#Checks if the policy leaves an account out.
+def account_skipped(policy, account):
+    account = str(account)
+    return account in policy.SkipAccounts or bool(policy.OnlyAccounts) and account not in policy.OnlyAccounts
@@ -0,0 +1,105 @@
+#Fused single-pass scanner. Reports are produced by collectors, plugins that name the resource types they read and turn the resources
+#of one region into report rows. The scanner lists each resource type the selected collectors need once per (account, region) and
+#hands the same listing to all of them, so running every report costs one scan of the fleet instead of one per report.
+#Images and instances come from the local inventory store, the RDS resources are listed in full. Stored images a collector would act on
+#are re-read from EC2 once per region for all the collectors, before any of them runs.
+
+from collections import namedtuple
+from cloudops.fanout import fan_out
+from cloudops.inventory import iter_db_instances, iter_db_clusters
+from cloudops.inventory_cache import region_images, cached_instances, refresh_images
+from cloudops.regions import get_all_regions
+from cloudops.session import get_client
+
+#A report plugin. ResourceTypes are keys of resourceTypes, Collect(scan) returns the rows of one region in Columns order.
+#Suffix is the report's file name after the account number, AccountColumn the column that already holds the account, if any.
+#Candidates(scan), when given, returns the images the collector would act on. Those that came from the store are re-read by the
+#scanner before Collect runs, so Collect sees their current records.
+Collector = namedtuple('Collector', ['Name', 'ResourceTypes', 'Collect', 'Suffix', 'Columns', 'AccountColumn', 'Candidates'], defaults = [None])
+
+#The resources of one (account, region) handed to every collector. Items maps a resource type to its list. Stale holds the resource
+#types that came from the inventory store in part, their items may have been deleted since the last run.
+RegionScan = namedtuple('RegionScan', ['Account', 'Region', 'Items', 'Stale'])
+
+#Resource types the collectors can read: type -> (service, lister). lister(client, account, region) returns (items, full),
+#full is False when the items came from the inventory store in part.
+resourceTypes = {
+    'images': ('ec2', region_images),
+    'instances': ('ec2', lambda ec2, account, region: (cached_instances(ec2, account, region), True)),
+    'db_instances': ('rds', lambda rds, account, region: (list(iter_db_instances(rds)), True)),
+    'db_clusters': ('rds', lambda rds, account, region: (list(iter_db_clusters(rds)), True)),
+}
+
+collectors = {}         #name -> Collector, in registration order.
+
+#Registers a collector and returns it. A collector registered under the same name again replaces the earlier one.
+def register_collector(collector):
+    unknown = [resourceType for resourceType in collector.ResourceTypes if resourceType not in resourceTypes]
+    if unknown:
+        raise ValueError(f"Collector {collector.Name} reads unknown resource types: {', '.join(unknown)}")
+    collectors[collector.Name] = collector
+    return collector
+
+#Returns the registered collectors with the given names, in registration order. Every registered collector when names is empty.
+def get_collectors(names = None):
+    unknown = [name for name in names or [] if name not in collectors]
+    if unknown:
+        raise ValueError(f"Unknown collectors {', '.join(unknown)}, use one of {', '.join(collectors)}")
+    return [collector for name, collector in collectors.items() if not names or name in names]
+
+#Re-reads the stored images any collector names as a candidate, the union of them in one pass, and returns the images of the scan
+#with the current records in place of the stored ones. Images that no longer exist are left out. Records the collectors whose
+#Candidates failed in results.
+def verify_candidates(scan, selected, results):
+    candidates = {}
+    for collector in selected:
+        if collector.Candidates:
+            try:
+                candidates.update((image['ImageId'], image) for image in collector.Candidates(scan))
+            except Exception as candidatesError:
+                results[collector.Name] = ([], candidatesError)
+    if not candidates:
+        return scan.Items['images']
+    records = refresh_images(get_client(scan.Account, 'ec2', scan.Region), scan.Account, scan.Region, candidates.values())
+    return [records.get(image['ImageId'], image) for image in scan.Items['images'] if image['ImageId'] in records or image['ImageId'] not in candidates]
+
+#Lists the resource types the collectors read in one region, each once, and hands the listing to every collector.
+#Returns {collector name: (rows, error)}, a collector that fails does not stop the others.
+def scan_region(account, region, selected):
+    items = {}
+    stale = set()
+    for resourceType in dict.fromkeys(resourceType for collector in selected for resourceType in collector.ResourceTypes):      #Each type once, in the order the collectors name them.
+        service, lister = resourceTypes[resourceType]
+        items[resourceType], full = lister(get_client(account, service, region), account, region)
+        if not full:
+            stale.add(resourceType)
+    scan = RegionScan(str(account), region, items, stale)
+    results = {}
+    if 'images' in stale:
+        items['images'] = verify_candidates(scan, selected, results)
+    for collector in selected:
+        if collector.Name in results:
+            continue
+        try:
+            results[collector.Name] = (collector.Collect(scan), None)
+        except Exception as collectError:
+            results[collector.Name] = ([], collectError)
+    return results
+
+#Scans every enabled region of an account, regionWorkers at a time, and returns ({collector name: rows in region order}, failures).
+#failures names the regions whose listing failed, and 'region (collector)' for a collector that failed in a region.
+def scan_account(account, selected, regionWorkers):
+    rows = {collector.Name: [] for collector in selected}
+    failures = []
+    for region, results, regionError in fan_out(get_all_regions(account), lambda region: scan_region(account, region, selected), regionWorkers):
+        if regionError:
+            print(f"An error has occurred in region {region}: {regionError}")
+            failures.append(region)
+            continue
+        for name, (regionRows, collectError) in results.items():
+            if collectError:
+                print(f"An error has occurred in region {region} in the {name} collector: {collectError}")
+                failures.append(f'{region} ({name})')
+                continue
+            rows[name].extend(regionRows)
+    return rows, failures
@@ -0,0 +1,82 @@
+#Process-wide pool of assumed-role sessions and clients. Every (account, region, service) client is built once per run and shared by all threads.
+
+import threading
+import boto3
+import botocore
+from datetime import datetime
+from botocore.config import Config
+from dateutil.tz import tzlocal
+from cloudops.ratelimit import attach_limits
+
+roleName = 'AWSCloudFormationStackSetExecutionRole'     #Role assumed in every managed account.
+
+poolLock = threading.Lock()     #Guards the pools below, boto3 sessions are not safe for concurrent client creation.
+stsLock = threading.Lock()      #Guards STS client creation on the shared base session during credential refreshes.
+baseSession = None              #Botocore session holding the caller's own credentials, created on first use.
+sessions = {}                   #account -> boto3 session with refreshable assumed-role credentials.
+clients = {}                    #(account, region, service) -> client.
+clientConfig = Config(retries = {'mode': 'standard', 'max_attempts': 3},     #botocore retries transient errors itself, throttled mutating calls are also retried by cloudops.ratelimit.
+                      max_pool_connections = 64)       #A client is shared by up to 64 threads: 8 buckets profiled 8 shards at a time, or the ~20 stage workers of the snapshot pipelines.
+sessionHooks = []               #Functions called with (account, session) for every new account session, used to attach botocore event handlers.
+
+def assumed_role_session(role_arn: str, base_session: botocore.session.Session = None):
+    base_session = base_session or boto3.session.Session()._session
+    def create_sts_client(*args, **kwargs):      #Credential refreshes from several threads share the base session.
+        with stsLock:
+            return base_session.create_client(*args, **kwargs)
+    fetcher = botocore.credentials.AssumeRoleCredentialFetcher(
+        client_creator = create_sts_client,
+        source_credentials = base_session.get_credentials(),
+        role_arn = role_arn,
+        extra_args = {
+        #    'RoleSessionName': None # set this if you want something non-default
+        }
+    )
+    creds = botocore.credentials.DeferredRefreshableCredentials(
+        method = 'assume-role',
+        refresh_using = fetcher.fetch_credentials,
+        time_fetcher = lambda: datetime.now(tzlocal())
+    )
+    botocore_session = botocore.session.Session()
+    botocore_session.register_component('data_loader', base_session.get_component('data_loader'))    #Service models and endpoint data are loaded once and shared by every account session.
+    botocore_session._credentials = creds
+    return boto3.Session(botocore_session = botocore_session)
+
+#Returns the ARN of the role assumed in a managed account.
+def account_role_arn(account):
+    return f'arn:aws:iam::{account}:role/{roleName}'
+
+#Returns the pooled session for an account, assuming the role the first time the account is used.
+def account_session(account):
+    global baseSession
+    account = str(account)
+    with poolLock:
+        if baseSession is None:
+            baseSession = boto3.session.Session()._session
+        if account not in sessions:
+            sessions[account] = assumed_role_session(account_role_arn(account), baseSession)
+            attach_limits(account, sessions[account])        #Mutating calls of every account share the rate control buckets.
+            for hook in sessionHooks:
+                hook(account, sessions[account])
+        return sessions[account]
+
+#Drops every pooled session and client, the next call assumes the roles again.
+def reset_pool():
+    with poolLock:
+        sessions.clear()
+        clients.clear()
+
+#Returns the pooled client for (account, region, service). A region of None uses the default region.
+def get_client(account, service, region = None):
+    key = (str(account), region, service)
+    session = account_session(account)
+    with poolLock:
+        if key not in clients:
+            clients[key] = session.client(service, region_name = region, config = clientConfig)
+        return clients[key]
+
+#Returns a new, unpooled client built with its own config, for calls that need other timeouts or retries than the pooled clients.
+def new_client(account, service, region = None, config = clientConfig):
+    session = account_session(account)
+    with poolLock:
+        return session.client(service, region_name = region, config = config)
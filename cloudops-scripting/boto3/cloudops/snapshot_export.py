@@ -0,0 +1,54 @@
+#Reads the "EBS Snapshots 3+ months old" cost export and groups its rows by account and region in a single pass.
+#Also converts snapshot records to and from deletion plan records.
+
+import csv
+from collections import namedtuple
+from cloudops.plan import PlanRecord
+
+#One snapshot row of the export. Only the columns the scripts use are kept, as a tuple instead of a dict per row.
+SnapshotRecord = namedtuple('SnapshotRecord', ['SnapshotID', 'Owner', 'Cost', 'AMI'])
+deleteAction = 'delete-snapshot'        #Plan action of a snapshot: deregister the AMIs listed after it, then delete it.
+
+#Finds the cost column. Its name changes with the month of the export, for example ' Cost - May 2024 '.
+def cost_column(header):
+    for column in header:
+        if column.strip().lower().startswith('cost'):
+            return column
+    raise ValueError(f"No cost column found in the export header: {header}")
+
+#Streams the export and returns {accountID: {region: [SnapshotRecord, ...]}}.
+#Accounts, regions and snapshots keep the order they first appear in the file. Memory grows with the grouped records, not with the input rows.
+def group_snapshots(pathName):
+    grouped = {}
+    with open(pathName, mode = 'r', newline = '', encoding = 'utf-8-sig') as file:      #utf-8-sig drops the byte order mark spreadsheet exports start with.
+        export = csv.reader(file)
+        header = next(export)
+        accountCol = header.index('Owner Id')
+        regionCol = header.index('Region Name')
+        snapshotCol = header.index('Snapshot Id')
+        ownerCol = header.index('owner2')
+        costCol = header.index(cost_column(header))
+        amiCol = header.index('AMI') if 'AMI' in header else None       #Only the exports used for AMI deregistration have this column.
+        for line in export:
+            if not line:
+                continue
+            regions = grouped.setdefault(line[accountCol], {})
+            regionRecords = regions.setdefault(line[regionCol], [])
+            amis = line[amiCol] if amiCol is not None else ''
+            regionRecords.append(SnapshotRecord(line[snapshotCol], line[ownerCol], line[costCol], amis))
+    return grouped
+
+
+#Returns the plan record of a snapshot. amis are the AMIs that must be deregistered before the snapshot can be deleted.
+def snapshot_plan_record(account, region, record, amis = ()):
+    return PlanRecord(account, region, deleteAction, [record.SnapshotID] + list(amis), record.Cost, record.Owner)
+
+#Turns the snapshot records of a plan back into {accountID: {region: [SnapshotRecord, ...]}}, the shape group_snapshots() returns.
+def group_planned_snapshots(planRecords):
+    grouped = {}
+    for record in planRecords:
+        if record.Action != deleteAction:
+            continue
+        regionRecords = grouped.setdefault(record.Account, {}).setdefault(record.Region, [])
+        regionRecords.append(SnapshotRecord(record.ResourceIds[0], record.Detail, record.Cost, '; '.join(record.ResourceIds[1:])))
+    return grouped
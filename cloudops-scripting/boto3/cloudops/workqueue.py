@@ -0,0 +1,183 @@
+#Local task queue in a SQLite file, shared by several worker processes. The work of a run is split into (account, region, phase) units:
+#a 'regions' unit per account lists the account's regions and adds a 'scan' unit per region. Workers claim whatever unit is next,
+#so a large account is spread over every process instead of keeping one busy while the others sit idle.
+#A claimed unit is leased. The lease is renewed while the unit runs, and a unit whose lease ran out (its worker crashed) is claimed again.
+#Finished units are kept, so with --resume a run that was interrupted picks up where it stopped. A queue file holds the units of one set of accounts.
+#The rows of an attempt that failed in part are kept with its unit, so work that finished before the failure is still reported.
+
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from cloudops import metrics
+from cloudops.regions import get_all_regions
+
+leaseSeconds = 300          #How long a claimed unit stays with its worker without a renewal.
+renewInterval = 60          #Seconds between lease renewals while a unit runs.
+maxAttempts = 3             #Claims of a unit before it is marked failed.
+pollInterval = 1.0          #Seconds an idle worker waits before looking for work again while other workers still hold units.
+
+schema = '''CREATE TABLE IF NOT EXISTS units (
+    account TEXT, region TEXT, phase TEXT, position INTEGER, state TEXT DEFAULT 'pending', owner TEXT, leaseUntil REAL DEFAULT 0,
+    attempts INTEGER DEFAULT 0, result TEXT, partial TEXT DEFAULT '[]', error TEXT, PRIMARY KEY (account, region, phase))'''
+
+#Opens the queue file. Every statement commits on its own unless it runs inside an explicit transaction.
+def connect(queuePath):
+    conn = sqlite3.connect(queuePath, timeout = 60, isolation_level = None)
+    conn.execute('PRAGMA journal_mode = WAL')       #Readers do not wait for the worker that is writing.
+    conn.execute(schema)
+    return conn
+
+#Adds the accounts of a run to the queue. The queue is started over unless resume is set and it holds an interrupted run, one with
+#units still pending or leased. An interrupted run is resumed only for the same accounts, its units that failed are given their attempts back.
+def open_queue(queuePath, accounts, resume = False):
+    conn = connect(queuePath)
+    interrupted = conn.execute("SELECT COUNT(*) FROM units WHERE state IN ('pending', 'leased')").fetchone()[0]
+    if not (resume and interrupted):
+        conn.execute('DELETE FROM units')
+    queued = {account for (account,) in conn.execute("SELECT account FROM units WHERE phase = 'regions'")}
+    if queued and queued != {str(account) for account in accounts}:
+        conn.close()
+        raise Exception(f"{queuePath} holds an interrupted run of other accounts, resume it with the same accounts, or leave out --resume to start over")
+    conn.execute("UPDATE units SET state = 'pending', attempts = 0 WHERE state = 'failed'")
+    conn.executemany("INSERT OR IGNORE INTO units (account, region, phase, position) VALUES (?, '', 'regions', ?)", [(str(account), position) for position, account in enumerate(accounts)])
+    conn.close()
+
+#Claims the next unit for owner and returns (account, region, phase), or None if no unit is ready.
+#Region lists are claimed first, so scan units are added while the other workers start on the first ones.
+#A unit whose lease ran out on its last attempt is marked failed instead of being claimed again.
+def claim(conn, owner):
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')     #Takes the write lock, two workers never claim the same unit.
+    try:
+        conn.execute("UPDATE units SET state = 'failed', error = ? WHERE state = 'leased' AND leaseUntil < ? AND attempts >= ?",
+                     (f'lease expired on attempt {maxAttempts}, the worker was lost', now, maxAttempts))
+        unit = conn.execute("""SELECT account, region, phase FROM units WHERE state = 'pending' OR (state = 'leased' AND leaseUntil < ?)
+                               ORDER BY phase = 'scan', rowid LIMIT 1""", (now,)).fetchone()
+        if unit:
+            conn.execute("UPDATE units SET state = 'leased', owner = ?, leaseUntil = ?, attempts = attempts + 1 WHERE account = ? AND region = ? AND phase = ?",
+                         (owner, now + leaseSeconds, *unit))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return unit
+
+#Renews the lease of a unit every renewInterval seconds until stop is set. Runs on its own thread with its own connection.
+def keep_lease(queuePath, owner, unit, stop):
+    conn = connect(queuePath)
+    while not stop.wait(renewInterval):
+        conn.execute("UPDATE units SET leaseUntil = ? WHERE account = ? AND region = ? AND phase = ? AND owner = ?", (time.time() + leaseSeconds, *unit, owner))
+    conn.close()
+
+#Marks a unit done and stores its result, after the rows kept from its earlier attempts.
+#Finishing a 'regions' unit adds a 'scan' unit per region in the same transaction.
+def complete(conn, unit, result):
+    account, region, phase = unit
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if phase == 'regions':
+            conn.executemany("INSERT OR IGNORE INTO units (account, region, phase, position) VALUES (?, ?, 'scan', ?)", [(account, name, position) for position, name in enumerate(result)])
+        partial = json.loads(conn.execute("SELECT partial FROM units WHERE account = ? AND region = ? AND phase = ?", unit).fetchone()[0])
+        conn.execute("UPDATE units SET state = 'done', result = ?, partial = '[]', error = NULL WHERE account = ? AND region = ? AND phase = ?", (json.dumps(partial + result), *unit))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+#Puts a unit back on the queue after an error, or marks it failed once it has used up its attempts.
+#rows are the rows of the work the failed attempt did finish, they are kept with the unit.
+def fail(conn, unit, unitError, rows = ()):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        partial = json.loads(conn.execute("SELECT partial FROM units WHERE account = ? AND region = ? AND phase = ?", unit).fetchone()[0])
+        conn.execute("UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, leaseUntil = 0, partial = ?, error = ? WHERE account = ? AND region = ? AND phase = ?",
+                     (maxAttempts, json.dumps(partial + list(rows)), str(unitError), *unit))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+#Runs one worker process. With metricsFile the worker records its API calls and writes the counters there for the process that started it.
+def worker_loop(queuePath, scanRegion, metricsFile = None):
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+    if metricsFile:
+        metrics.start_metrics(owner)
+    try:
+        run_units(queuePath, scanRegion, owner)
+    finally:
+        if metricsFile:
+            metrics.save_counters(metricsFile)
+
+#Claims and runs units until none are left. scanRegion(account, region) returns (rows, error) for one region: the json-serializable
+#rows of the work that finished and None, or the error of the part that failed.
+def run_units(queuePath, scanRegion, owner):
+    conn = connect(queuePath)
+    while True:
+        unit = claim(conn, owner)
+        if unit is None:
+            if not conn.execute("SELECT COUNT(*) FROM units WHERE state IN ('pending', 'leased')").fetchone()[0]:
+                break
+            time.sleep(pollInterval)        #Units leased by other workers may still come back if a worker crashes.
+            continue
+        account, region, phase = unit
+        stop = threading.Event()
+        keeper = threading.Thread(target = keep_lease, args = (queuePath, owner, unit, stop), daemon = True)
+        keeper.start()
+        try:
+            result, unitError = (get_all_regions(account), None) if phase == 'regions' else scanRegion(account, region)
+            if unitError:
+                print(f"An error has occurred in account {account} {region} during {phase}: {unitError}")
+                fail(conn, unit, unitError, result)
+            else:
+                complete(conn, unit, result)
+        except Exception as unitError:
+            print(f"An error has occurred in account {account} {region or ''} during {phase}: {unitError}")
+            fail(conn, unit, unitError)
+        finally:
+            stop.set()
+            keeper.join()
+    conn.close()
+
+#Returns {account: (rows in region order, failures)} for the accounts in the queue, in the order they were added.
+#failures lists the regions that failed, or the error of the region list when the account's regions could not be listed.
+#A region that failed still gives the rows its attempts finished.
+def collect(queuePath):
+    conn = connect(queuePath)
+    results = {}
+    for account, phase, region, state, result, partial, error in conn.execute("SELECT account, phase, region, state, result, partial, error FROM units ORDER BY phase = 'scan', position"):
+        rows, failures = results.setdefault(account, ([], []))
+        if state == 'done' and phase == 'scan':
+            rows.extend(json.loads(result))
+        elif state != 'done':
+            rows.extend(json.loads(partial))
+            failures.append(f"{region or 'region list'}: {error}")
+    conn.close()
+    return results
+
+#Runs scanRegion for every region of every account on a pool of worker processes and returns collect()'s results.
+#scanRegion must be a module-level function, the workers are started fresh and import it by name.
+#When metrics are on, each worker records its own API calls and they are added to this process's counters once it exits.
+#With resume an interrupted run in the queue file is carried on instead of started over.
+def run_queue(queuePath, accounts, scanRegion, processes, resume = False):
+    open_queue(queuePath, accounts, resume)
+    context = multiprocessing.get_context('spawn')      #Fresh processes, no boto3 session or lock is inherited half-used.
+    metricsFiles = [f'{queuePath}.metrics{worker}' if metrics.metricsPath else None for worker in range(processes)]
+    workers = [context.Process(target = worker_loop, args = (queuePath, scanRegion, metricsFile)) for metricsFile in metricsFiles]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    for metricsFile in filter(None, metricsFiles):
+        metrics.merge_counters(metricsFile)
+    return collect(queuePath)
+
+#Adds the worker process options to a script's argument parser.
+def add_queue_arguments(parser, scriptName):
+    parser.add_argument('--processes', type = int, default = 0, metavar = 'N', help = 'split the accounts into (account, region) units and run them on N worker processes')
+    parser.add_argument('--queue-file', default = f'{scriptName}.queue.db', metavar = 'PATH', help = 'SQLite file of the work queue')
+    parser.add_argument('--resume', action = 'store_true', help = 'carry on the interrupted run in the queue file instead of starting over')
+    return parser
@@ -2,133 +2,130 @@
 #Steps: 1. Gather list of old AMIs with snapshots - completed
 #       2. Delete automatically generated AMI backups (recovery points) - completed
 
-import boto3
-import botocore
-import csv
-from datetime import datetime
-from dateutil.tz import tzlocal
+import argparse
+from cloudops import metrics
+from cloudops.accounts import read_csv
+from cloudops.fanout import fan_out, scan_regions
+from cloudops.workqueue import run_queue, add_queue_arguments
+from cloudops.session import account_role_arn, get_client
+from cloudops.regions import get_all_regions
+from cloudops.instances import index_instances, ami_inUse
+from cloudops.inventory_cache import cached_images, cached_instances
+from cloudops.recovery_points import recovery_point_index, recovery_points_by_vault
+from cloudops.retention import load_policy, select_images, account_skipped
+from cloudops.reports import open_report, end_account, add_report_arguments
 
 accountCSV = 'auto_Corporate_accounts.csv'   #CSV with list of managed accounts.
 backupCSV = '_test_amibackups_May3.csv'   #CSV to be created for each account.
-daysChecked = 180                       #checks for resources greater than the number of days
-keyword = "AwsBackup"                 #variable to search for the keyword in the ami-image name.
+backupColumns = ['Name', 'ImageID', 'ImageLocation', 'CreationDate', 'Region', 'OwnerID', 'SnapshotID', 'Volume Size', 'Cost Savings', 'RPDeletionStatus']    #Column headings in csv files.
+policyName = 'delete_BackUpService_AMIs'     #Section of retention_policy.json with the age and name rules of the AMIs to delete.
 volumeCost = 0.05                       #Cost of storing volume in US regions.
 costSavings = 0.00
+accountWorkers = 8                     #Number of accounts processed at the same time.
+regionWorkers = 4                      #Number of regions scanned at the same time within an account.
 
-def assumed_role_session(role_arn: str, base_session: botocore.session.Session = None):
-    base_session = base_session or boto3.session.Session()._session
-    fetcher = botocore.credentials.AssumeRoleCredentialFetcher(
-        client_creator = base_session.create_client,
-        source_credentials = base_session.get_credentials(),
-        role_arn = role_arn,
-        extra_args = {
-        #    'RoleSessionName': None # set this if you want something non-default
-        }
-    )
-    creds = botocore.credentials.DeferredRefreshableCredentials(
-        method = 'assume-role',
-        refresh_using = fetcher.fetch_credentials,
-        time_fetcher = lambda: datetime.now(tzlocal())
-    )
-    botocore_session = botocore.session.Session()
-    botocore_session._credentials = creds
-    return boto3.Session(botocore_session = botocore_session)
+#Delete the recovery points of AMIs in one AWS Backup Vault and return the deletion status of each AMI.
+def delete_repoints(backup, vaultName, recoveryPoints):
+    deleteStatus = {}
+    for imageName, rpName in recoveryPoints:
+        try:
+            #backup.delete_recovery_point(BackupVaultName = vaultName, RecoveryPointArn = rpName)
+            print(f'The Backup Service has deleted recovery point {rpName} associated with {imageName} in {vaultName}.')
+            deleteStatus[imageName] = True
+        except Exception as errorDRP:
+            print(f"An error with recovery point deletion has occurred: {errorDRP}")
+            deleteStatus[imageName] = False
+    return deleteStatus
 
-#Return all regions available to the EC2 clients.
-def get_all_regions(session):
-    ec2 = session.client('ec2')
-    return [region['RegionName'] for region in ec2.describe_regions()['Regions']]
-
-#Check if ami was used to launch an active EC2 instance
-def ami_inUse(client, imageId):
-    instances = client.describe_instances()
-    for reservation in instances['Reservations']: #This loop looks for EC2 instances that were launched with the ami and skips deletion if an instance is found.
-        instance = reservation['Instances'][0]  #information on image for EC2 instance.
-        if instance['ImageId'] == imageId:
-            print(f"{instance['ImageId']} was used to launch an existing EC2 instance")
-            return True
-    return False
-
-#Delete recovery point of AMI in AWS Backup Vault
-def delete_repoint(session, imageName, regionName):
+#Deletes the recovery points of the given AMIs, vault by vault, using one recovery point index for the region.
+def delete_old_repoints(backup, imageIds):
+    deleteStatus = {}
     try:
-        backup = session.client('backup', region_name = regionName)
-        listVaults = backup.list_backup_vaults()        #obtains a list of the backup vaults in the account and specific region.
-        for vault in listVaults['BackupVaultList']:     #This loop gets the specific vault name and looks for EC2 recovery points in that vault.
-            vaultName = vault['BackupVaultName']
-            listRPs = backup.list_recovery_points_by_backup_vault(BackupVaultName = vaultName, ByResourceType = 'EC2')
-            for recoveryPoint in listRPs['RecoveryPoints']:     #This loop looks for the recovery point that matches the ami backup identified for deletion.
-                if imageName in recoveryPoint['RecoveryPointArn']:
-                    rpName = recoveryPoint['RecoveryPointArn']
-                    #backup.delete_recovery_point(BackupVaultName = vaultName, RecoveryPointArn = rpName)
-                    print(f'The Backup Service has deleted recovery point {rpName} associated with {imageName} in {vaultName}.')
-                    return True
+        rpIndex = recovery_point_index(backup)      #Lists every vault and EC2 recovery point in the region once.
     except Exception as errorDRP:
         print(f"An error with recovery point deletion has occurred: {errorDRP}")
-        return False
+        return {imageId: False for imageId in imageIds}
+    byVault, missing = recovery_points_by_vault(rpIndex, imageIds)
+    for imageName in missing:
+        print(f'No recovery point was found for {imageName}.')
+        deleteStatus[imageName] = False
+    for vaultName, recoveryPoints in byVault.items():
+        deleteStatus.update(delete_repoints(backup, vaultName, recoveryPoints))
+    return deleteStatus
+
+#Locates old AMI backups in one region and deletes their recovery points. Returns the csv rows for the region.
+def region_ami_backups(account, region, ec2, backup, policy):
+    regionRows = []
+    oldAmis = []            #Old AMIs that are not in use, their recovery points are deleted once the region has been scanned.
+    print(f"\n ", region)
+    imageIndex = None      #Index of AMIs used by instances in this region, built when the first old AMI is found.
+    for ami in cached_images(ec2, account, region, lambda images: select_images(policy, images)):        #Iterates through the AMIs the retention policy selects (from the local inventory store plus the AMIs created since the last run), the policy runs over the whole region at once.
+        amiId = ami['ImageId']
+        if imageIndex is None:
+            imageIndex = index_instances(cached_instances(ec2, account, region))
+        amiUsed = ami_inUse(imageIndex,amiId)
+        if not amiUsed:     #If the ami is not used to launch an active instance then proceed with deletion.
+            print(f'Beginning process to delete recovery point associated with {amiId}')
+            oldAmis.append(ami)
+        else:
+            print(f'This AMI ID: {amiId} was used to launch an active EC2 instance')
+    if not oldAmis:
+        return regionRows
+    deleteStatus = delete_old_repoints(backup, [ami['ImageId'] for ami in oldAmis])
+    for ami in oldAmis:
+        deleteRP = deleteStatus[ami['ImageId']]
+        for ebs in ami['BlockDeviceMappings']:  #Iterates through AMI's devices
+            if (ebs.get('Ebs')):    #Checks if an AMI has associated snapshots.
+                costSavings = ebs['Ebs']['VolumeSize'] * volumeCost
+                amiData = [ami['Name'], ami['ImageId'], ami['ImageLocation'], ami['CreationDate'], region, ami['OwnerId'], ebs['Ebs']['SnapshotId'], ebs['Ebs']['VolumeSize'], costSavings, deleteRP, ]
+                regionRows.append(amiData)
+    return regionRows
 
-#Locates old AMI backups in managed accounts and stores the AMI IDs and associated snapshot IDs in a CSV.
-def ami_backups(session,pathName,oldDays,substring):
-    with open(pathName, mode = 'w', newline='')	as file:
-        header = ['Name', 'ImageID', 'ImageLocation', 'CreationDate', 'Region', 'OwnerID', 'SnapshotID', 'Volume Size', 'Cost Savings', 'RPDeletionStatus']    #Column headings in csv files.
-        amiBackups = csv.writer(file, delimiter=',')
-        amiBackups.writerow(header)     #writes the column headings to the top of the file
-        regions = get_all_regions(session)
-        for region in regions:      #Iterates through each region in the managed accounts with the exception of "ap-southeast-4".
-            print(f"\n ", region)
-            if region == "ap-southeast-4":
-                continue
-            ec2 = session.client('ec2', region_name = region)
-            images = ec2.describe_images(Owners=['self'])   #The 'self' value scopes the images to just the specified account.
-            for ami in images['Images']:        #Iterates through all the AMIs in an account and stores AMI IDs older than the days specified.
-                amiName = ami['Name']
-                amiId = ami['ImageId']
-                if amiId == 'ami-0af8f6b15e751fa6d':    #Skip particular amis if necessary
-                    print(f'Skipping {amiId}!!!')
-                    continue
-                if substring.lower() in amiName.lower():    #Checks if ami name meets the search criteria.
-                    dateString = datetime.strptime(ami['CreationDate'], '%Y-%m-%dT%H:%M:%S.000Z')   #Converts the date to a usable format for calculations.
-                    timeDiff = datetime.now() - dateString
-                    if timeDiff.days > oldDays:
-                        amiUsed = ami_inUse(ec2,amiId)
-                        if not amiUsed:     #If the ami is not used to launch an active instance then proceed with deletion.
-                            print(f'Beginning process to delete recovery point associated with {amiId}')
-                            deleteRP = delete_repoint(session, amiId, region) #this uses same ami id multiple times as an ami might have many attached devices
-                            for ebs in ami['BlockDeviceMappings']:  #Iterates through AMI's devices
-                                if (ebs.get('Ebs')):    #Checks if an AMI has associated snapshots.
-                                    costSavings = ebs['Ebs']['VolumeSize'] * volumeCost
-                                    amiData = [ami['Name'], ami['ImageId'], ami['ImageLocation'], ami['CreationDate'], region, ami['OwnerId'], ebs['Ebs']['SnapshotId'], ebs['Ebs']['VolumeSize'], costSavings, deleteRP, ]
-                                    amiBackups.writerow(amiData)
-                        else:
-                            print(f'This AMI ID: {amiId} was used to launch an active EC2 instance')
+#Locates old AMI backups in managed accounts and hands the AMI IDs and associated snapshot IDs to the report.
+def ami_backups(account,report,policy):
+    regions = get_all_regions(account)     #Every enabled region in the managed account, from the shared region catalog.
+    results, failedRegions = scan_regions(account, 'ec2', regions, lambda region, ec2: region_ami_backups(account, region, ec2, get_client(account, 'backup', region), policy), regionWorkers)    #Regions are scanned concurrently, rows come back in region order.
+    end_account(report, account, [row for regionRows in results for row in regionRows])
+    if failedRegions:
+        raise Exception(f"AMI scan failed in regions {', '.join(failedRegions)}")
 
+#Scans one region of an account and returns its csv rows and no error. Run by the work queue workers.
+def scan_region(account, region):
+    return region_ami_backups(account, region, get_client(account, 'ec2', region), get_client(account, 'backup', region), load_policy(policyName)), None
 
-#Reads a csv file of managed accounts and returns the account numbers in a list.
-def read_csv(pathName):
-    accountNum = []     #List to store account numbers.
-    lineCount = 0
-    with open(pathName, mode = 'r') as file:
-        accountsList = list(csv.reader(file))
-        for acct in accountsList:   #Reads the csv file with managed accounts and appends the account numbers to a list.
-            if lineCount == 0:
-                lineCount += 1
-                continue
-            accountNum.append(acct[0])
-    return accountNum
 
     
-def main():
+#Assumes the role in one account and writes that account's part of the report.
+def process_account(account, report):
+    print(account_role_arn(account))
+    ami_backups(account, report, load_policy(policyName))
+
+def main(argv = None):
+    args = add_report_arguments(add_queue_arguments(argparse.ArgumentParser(description = 'Deletes the recovery points of old AWS Backup AMIs.'), 'delete_BackUpService_AMIs')).parse_args(argv)
+    metrics.start_metrics('delete_BackUpService_AMIs')      #Records API call counts and latency when CLOUDOPS_METRICS is set.
     try:
-        accountNumber = read_csv(accountCSV)
-        for account in accountNumber:
-            accountARN = f'arn:aws:iam::{account}:role/AWSCloudFormationStackSetExecutionRole'
-            print(accountARN)
-            session = assumed_role_session(accountARN)
-            prefix = str(account) #Helps to create a separate csv file of ami backups for each account.
-            ami_backups(session,(prefix + backupCSV), daysChecked, keyword)
-            
+        policy = load_policy(policyName)
+        accountNumber = [account for account in read_csv(accountCSV) if not account_skipped(policy, account)]     #Accounts the retention policy leaves out are not scanned.
+        failedAccounts = []
+        with open_report(backupCSV, backupColumns, args.consolidated, args.report_format) as report:     #Rows are written by the report's own thread while the accounts run.
+            if args.processes:      #Queue mode: every (account, region) is a unit of work for the worker processes.
+                for account, (rows, failures) in run_queue(args.queue_file, accountNumber, scan_region, args.processes, args.resume).items():
+                    end_account(report, account, rows)
+                    if failures:
+                        print(f"An error has occurred in account {account}: {'; '.join(failures)}")
+                        failedAccounts.append(account)
+            else:
+                for account, result, accountError in fan_out(accountNumber, lambda account: process_account(account, report), accountWorkers):    #Accounts are processed concurrently, a failure in one account does not stop the others.
+                    if accountError:
+                        print(f"An error has occurred in account {account}: {accountError}")
+                        failedAccounts.append(account)
+        if failedAccounts:
+            print(f"\nAccounts that failed: {', '.join(failedAccounts)}")
+
     except Exception as e:
         print(f"An error has occurred: {e}")
+    finally:
+        metrics.write_metrics()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
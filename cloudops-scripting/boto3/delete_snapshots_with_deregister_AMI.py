@@ -1,157 +1,38 @@
 #This script reads a csv file of AWS Snapshots and deletes the snapshots.
 
-import boto3
-import botocore
-import csv
-from datetime import datetime
-from dateutil.tz import tzlocal
+import argparse
+import threading
+from cloudops import journal, metrics
+from cloudops.fanout import fan_out, once_per_region
+from cloudops.pipeline import run_pipeline
+from cloudops.session import account_role_arn, get_client
+from cloudops.ratelimit import retry_throttled
+from cloudops.preflight import preflight, account_ok
+from cloudops.snapshot_export import group_snapshots, snapshot_plan_record, group_planned_snapshots
+from cloudops.plan import parse_plan_args, write_plan, read_plan
+from cloudops.instances import image_index, image_index_cache, ami_inUse
+from cloudops.images import snapshot_image_map, image_states
+from cloudops.retention import load_policy, account_skipped
 
 accountCSV = 'test.csv'   #CSV with list of managed accounts.
 snapshotCSV = 'adeleted_snapshots.csv' #CSV list with list of snapshotIDs and associated account number
-
-def assumed_role_session(role_arn: str, base_session: botocore.session.Session = None):
-    base_session = base_session or boto3.session.Session()._session
-    fetcher = botocore.credentials.AssumeRoleCredentialFetcher(
-        client_creator = base_session.create_client,
-        source_credentials = base_session.get_credentials(),
-        role_arn = role_arn,
-        extra_args = {
-        #    'RoleSessionName': None # set this if you want something non-default
-        }
-    )
-    creds = botocore.credentials.DeferredRefreshableCredentials(
-        method = 'assume-role',
-        refresh_using = fetcher.fetch_credentials,
-        time_fetcher = lambda: datetime.now(tzlocal())
-    )
-    botocore_session = botocore.session.Session()
-    botocore_session._credentials = creds
-    return boto3.Session(botocore_session = botocore_session)
-
-#This function reads the csv file and generates a list of dictionaries which contain the account ID, a list of regions, and a list of snapshot IDs.
+journalFile = 'adeleted_snapshots.journal'     #Journal of finished deletions, delete it to start over from the top of the export.
+accountWorkers = 8                     #Number of accounts processed at the same time.
+deregisterWorkers = 4                  #Number of snapshots whose AMIs are checked and deregistered at the same time within an account.
+deleteWorkers = 8                      #Number of snapshots deleted at the same time within an account.
+queueSize = 100                        #Items waiting between two pipeline stages, a stage pauses when the next one falls behind.
+policyName = 'delete_snapshots_with_deregister_AMI'     #Section of retention_policy.json with the accounts whose snapshots are never deleted.
+
+#This function reads the csv file and returns a dictionary of account ID -> region -> list of snapshot records, without the accounts the retention policy leaves out.
 def acct_list(pathName):
-    acctSnapshotList = []       #A list to store the snapshot IDs for each account.
-    acctRegionList = []         #A list to store the region of each snapshot ID for each account.
-    acctSnapshotOwnerList = []  #A list to store the owner of each snapshot ID for eacha account.
-    acctSnapshotCostList = []   #A list to store the cost of each snapshot ID for each account.
-    acctSnapshotAMIList = []    ##ADDED A list to store the AMI, if has any, of each snapshot ID for each account.
-    accountDict = {'AccountID': '', 'Region': acctRegionList, 'SnapshotID': acctSnapshotList, 'Owner': acctSnapshotOwnerList, 'Cost': acctSnapshotCostList, 'AMI': acctSnapshotAMIList}       #defines the format of the dictionary
-    currentAcct = ''
-    accountList = []            #A list to store all the account dictionaries
-    flag = False                
-    with open(pathName, mode = 'r') as file:
-        csvDict = csv.DictReader(file)          #reads the csv file and puts each line of data into a dictionary.
-        infoCSV = list(csvDict)                 #creates a list of dicitonaries
-        for line in infoCSV:                    #iterates through the list of dictionaries
-            currentAcct = line['Owner Id']
-            for acct in accountList:            #iterates through the currently stored account dictionaries.
-                if acct['AccountID'] == currentAcct:    #checks if an account dictionary already exists adds the region and snapshot data if it does.
-                    acct['Region'].append(line['Region Name'])      #Adds the current region value to the end of the existing list.
-                    acct['SnapshotID'].append(line['Snapshot Id'])
-                    acct['Owner'].append(line['owner2'])
-                    acct['Cost'].append(line[' Cost - May 2024 '])
-                    acct['AMI'].append(line['AMI']) #ADDED
-                    flag = True
-                    break                               #exits the loop once the account data has been recorded.
-                else:
-                    flag = False                #if the account is not found in the current list, then set flag to create a new account dictionary.  
-            if not flag:                        #Creates an account dictionary for new accounts and adds it to the list. 
-                acctSnapshotList = []
-                acctRegionList = []
-                acctSnapshotOwnerList = []
-                acctSnapshotCostList = []
-                acctSnapshotAMIList = []  #ADDED
-                accountDict = {'AccountID': '', 'Region': acctRegionList, 'SnapshotID': acctSnapshotList, 'Owner': acctSnapshotOwnerList, 'Cost': acctSnapshotCostList, 'AMI': acctSnapshotAMIList}   #Sets the format of the account dictionary.
-                accountDict.update(AccountID= currentAcct)
-                acctRegionList.append(line['Region Name'])
-                acctSnapshotList.append(line['Snapshot Id'])
-                acctSnapshotOwnerList.append(line['owner2'])
-                acctSnapshotCostList.append(line[' Cost - May 2024 ']) 
-                acctSnapshotAMIList.append(line['AMI']) #ADDED
-                accountDict.update(Region= acctRegionList, SnapshotID = acctSnapshotList, Owner = acctSnapshotOwnerList, Cost = acctSnapshotCostList, AMI = acctSnapshotAMIList)       #updates the account dictionary with the list of regions and list of snapshots
-                accountList.append(accountDict)     #adds the account dictionary to the existing list of account dictionaries.
-                flag = True  
-
-    return accountList      #returns the list of account dictionaries.
-
-#This function runs a simple command to validate authentication into the AWS Account.
-def validate_acct(session):
-    try:
-        ec2 = session.client('ec2')
-        regions = ec2.describe_regions()        #random api call to check if the created role can authenticate into the AWS Account.
-        print('Validation success!')
-        return True
-    except Exception as validationError:
-        print(f"A validation error has occurred: {validationError}")
-        return False
-
-#This function creates a list of dictionaries of snapshots for each region of the current account.
-def regional_snapshots(acctSnapshots): 
-        try:
-            regionSnapshotList = []
-            regionOwnerList = []
-            regionCostList = []
-            regionAMIList = [] #ADDED
-            regionDict = {'Region': '', 'Snapshots': regionSnapshotList, 'Owners': regionOwnerList, 'Costs': regionCostList, 'AMI': regionAMIList}     #Sets the format of the region dictionary.
-            currentRegion = ''
-            regionList = [] #list of dictionaries with region and list of associated snapshots.
-
-            snapshots = acctSnapshots['SnapshotID']     #Stores the list of snapshots associated with the current account
-            owners = acctSnapshots['Owner']
-            costs = acctSnapshots['Cost']
-            regions = acctSnapshots['Region']           #Stores the list of regions that each snapshot is located in.
-            AMI = acctSnapshots['AMI']                  #ADDED: Store the AMIs, if any, that the snapshot was created for
-            counter = len(snapshots)                    #Gets the number of snapshots stored in the list.
-            
-            flag = False
-            for iterator in range(counter):             #Creates a loop to iterate through the entire list of snapshots and regions.
-                currentRegion = regions[iterator]
-                for region in regionList:               #iterates through the currently stored region dictionaries.
-                    if region['Region'] == currentRegion:       #Checks if the region dictionary already exists and adds the snapshot data if it does.
-                        region['Snapshots'].append(snapshots[iterator])     #The 'iterator' value ensures that the region-snapshot pairing is retained.
-                        region['Owners'].append(owners[iterator])
-                        region['Costs'].append(costs[iterator])
-                        region['AMI'].append(AMI[iterator])
-                        flag = True
-                        break                           #exits the loop once the region data has been recorded.
-                    else:
-                        flag = False                    #If region not found in current list then set flag to create new region dictionary.
-                if not flag:                            #Creates a region dictionary for new regions and adds it to the list
-                    regionSnapshotList = []
-                    regionOwnerList = []
-                    regionCostList = []
-                    regionAMIList = [] #ADDED
-                    regionDict = {'Region': '', 'Snapshots': regionSnapshotList, 'Owners': regionOwnerList, 'Costs': regionCostList, 'AMI': regionAMIList}        #Sets the format of the dictionary.
-                    regionDict.update(Region = currentRegion)
-                    regionSnapshotList.append(snapshots[iterator])
-                    regionOwnerList.append(owners[iterator])
-                    regionCostList.append(costs[iterator])
-                    regionAMIList.append(AMI[iterator]) #ADDED
-                    regionDict.update(Snapshots = regionSnapshotList, Owners = regionOwnerList, Costs = regionCostList, AMI = regionAMIList)                   #Updates the region dictionary with the list of snapshots
-                    regionList.append(regionDict)                                       #Adds the region dictionary to the existing list of region dictionaries.
-                    flag = True
-
-            return regionList       #returns the list of region dictionaries.
-
-        except Exception as errorSS:
-            print(f"An error has occurred in region: {errorSS}") 
-
-#Check if ami was used to launch an active EC2 instance
-#ADDED
-def ami_inUse(client, imageId):
-    instances = client.describe_instances()
-    for reservation in instances['Reservations']: #This loop looks for EC2 instances that were launched with the ami and skips deletion if an instance is found.
-        instance = reservation['Instances'][0]  #information on image for EC2 instance.
-        if instance['ImageId'] == imageId:
-            print(f"{instance['ImageId']} was used to launch an existing EC2 instance")
-            return True
-    return False
+    policy = load_policy(policyName)
+    return {account: regions for account, regions in group_snapshots(pathName).items() if not account_skipped(policy, account)}      #single streaming pass over the export, grouped by account and region.
 
 #Deregisters an AMI based on the image_id and returns the success status
 #ADDED
 def deregister_ami(ec2,imageID):
     try:
-        ec2.deregister_image(ImageId = imageID)
+        retry_throttled(ec2.deregister_image, ImageId = imageID)      #Rate controlled, throttled calls are retried before they count as failed.
         print(f"AMI ID: {imageID} has been successfully deregistered!")
         return True
     except Exception as errorDA:
@@ -160,85 +41,178 @@ def deregister_ami(ec2,imageID):
     
 #Deregister all AMIs associated with snapshot, if all deregistered, return TRUE
 #ADDED
-def deregister_all_amis(ec2, ami_list,):
+def deregister_all_amis(ec2, ami_list, imageStates, imageIndex, acct, regionName):
     for ami in ami_list:
-        response = ec2.describe_images(ImageIds=[ami])
-        ami_image = response['Images'][0]
-        state = ami_image.get('State', 'Unknown')
+        if journal.is_finished(acct, regionName, ami):     #Deregistered by an earlier, interrupted run.
+            continue
+        state = imageStates.get(ami, 'Unknown')       #State from the region's image lookup, AMIs missing from it no longer exist.
         if state == 'available':
-            if not ami_inUse(ec2, ami): # ADDED If AMI not in use, deregister AMI
+            if not ami_inUse(imageIndex, ami): # ADDED If AMI not in use, deregister AMI
                 success = deregister_ami(ec2, ami)
                 if not success: #return false if failed to deregister any AMI
                     return False
+                imageStates[ami] = 'deregistered'
+                journal.record(acct, regionName, ami, 'Success')
             else: # ADDED If AMI is in use, cannot deregister AMI so cannot delete snapshot, return False
                 return False
     return True
 
-#This function makes the API call to delete snapshots using the snapshotID.
-def delete_snapshots(session, snaps,acct,writeCsv):
-    regionDictionaries = snaps
-    for region in regionDictionaries:
-        ec2 = session.client('ec2', region_name =  region['Region'])    #Creates the EC2 client that will make the API calls
-        print(f"\n ", region['Region'])
-        iterator = 0
-        for snap in region['Snapshots']:    #Iterates through the list of snapshotIDs in the region.
-            try:
-                AMI_list = []
-                owner = region['Owners'][iterator]              #Ensures the owner selected from the list matches the correct snapshot. 
-                cost = region['Costs'][iterator]
-                AMI_string = region['AMI'][iterator] #ADDED 
-                print(len(region['Snapshots']))
-                print(len(region['AMI']))
-                print(len(AMI_list))
-                AMI_list = AMI_string.split('; ') #ADDED separate AMIs as list of all AMIs is separated by ; (destination, source)
-                print(len(AMI_list))
-                print(AMI_list)
-                if AMI_list !=  ['']: # ADDED if the snapshot is associated with at least 1 AMI, deregister the AMIs before deleting snapshot
-                    success_deregister = deregister_all_amis(ec2, AMI_list)
-                    if not success_deregister: #If unable to deregister any AMIs, cannot proceed with deleting the snapshot
-                        print(f'{snap} cannot be deleted as associated with active EC2 AMI')
-                        acctValidData = [acct, region['Region'], snap, 'Success', 'Failed', owner, cost]     #The format of the output data if the deletion fails.
-                        writeCsv.writerow(acctValidData)
-                        iterator += 1
-                        break      
-                ec2.delete_snapshot(SnapshotId = snap)         #The API call that deletes a snapshot based on the snapshot ID.
-                print(f'{snap} has been successfully deleted!!!')
-                acctValidData = [acct, region['Region'], snap, 'Success', 'Success', owner, cost]    #The format of the output data if the deletion is successful.
-                writeCsv.writerow(acctValidData)                                        #Writes the output to the specfied csv file.
-                iterator += 1
-
-            except Exception as deleteError:
-                print(f"An deletion error has occurred: {deleteError}")
-                acctValidData = [acct, region['Region'], snap, 'Success', 'Failed', owner, cost]     #The format of the output data if the deletion fails.
-                writeCsv.writerow(acctValidData)
-                iterator += 1
+#Looks up the images of one region: a map of snapshot ID -> images from one pass over the account's AMIs, and the state of
+#every AMI in that map or named in the export. AMIs the account does not own are looked up in batches, not one call each.
+def region_images(acct, regionName, records):
+    ec2 = get_client(acct, 'ec2', regionName)
+    snapshotImages = snapshot_image_map(ec2)
+    imageStates = {image['ImageId']: image['State'] for images in snapshotImages.values() for image in images}
+    exportAmis = {ami for record in records for ami in record.AMI.split('; ') if ami}       #The export separates AMIs with ; (destination, source)
+    imageStates.update(image_states(ec2, exportAmis - imageStates.keys()))
+    return snapshotImages, imageStates
+
+#Returns the AMIs that reference a snapshot: the ones found in the region now, then any other AMI the export names.
+def snapshot_amis(record, snapshotImages):
+    amis = [image['ImageId'] for image in snapshotImages.get(record.SnapshotID, [])]
+    amis.extend(ami for ami in record.AMI.split('; ') if ami)      #The export can be stale, AMIs deregistered since are skipped by their state.
+    return list(dict.fromkeys(amis))
+
+#Lists the snapshot records of every region that were not finished by an earlier, interrupted run.
+def pending_records(regions, acct):
+    for regionName, records in regions.items():
+        print(f"\n ", regionName)
+        for record in records:    #Iterates through the snapshot records in the region.
+            if not journal.is_finished(acct, regionName, record.SnapshotID):
+                yield regionName, record
+
+#Deregisters the AMIs of a snapshot before it is deleted. Snapshots that cannot be deleted are passed on with their failed csv row.
+#amiLock returns the lock of an AMI, so an AMI shared by several snapshots is deregistered once.
+def deregister_stage(acct, pending, regionImages, imageIndexes, amiLock):
+    regionName, record = pending
+    try:
+        snapshotImages, imageStates = regionImages(regionName)
+        AMI_list = snapshot_amis(record, snapshotImages)
+        if AMI_list: # ADDED if the snapshot is associated with at least 1 AMI, deregister the AMIs before deleting snapshot
+            ec2 = get_client(acct, 'ec2', regionName)    #Pooled EC2 client that will make the API calls
+            imageIndex = imageIndexes(regionName)
+            for ami in AMI_list:
+                with amiLock(regionName, ami):
+                    success_deregister = deregister_all_amis(ec2, [ami], imageStates, imageIndex, acct, regionName)
+                if not success_deregister: #If unable to deregister any AMIs, cannot proceed with deleting the snapshot
+                    print(f'{record.SnapshotID} cannot be deleted as associated with active EC2 AMI')
+                    return [(regionName, record, [acct, regionName, record.SnapshotID, 'Success', 'Failed', record.Owner, record.Cost])]     #The format of the output data if the deletion fails.
+        return [(regionName, record, None)]
+    except Exception as deleteError:
+        print(f"An deletion error has occurred: {deleteError}")
+        return [(regionName, record, [acct, regionName, record.SnapshotID, 'Success', 'Failed', record.Owner, record.Cost])]
+
+#This function makes the API call to delete snapshots using the snapshotID and writes the csv row as soon as the snapshot is done.
+def delete_stage(acct, deregistered, writeRows):
+    regionName, record, failedRow = deregistered
+    if failedRow:
+        writeRows([failedRow])
+        return []
+    try:
+        retry_throttled(get_client(acct, 'ec2', regionName).delete_snapshot, SnapshotId = record.SnapshotID)         #The API call that deletes a snapshot based on the snapshot ID, retried while throttled.
+        print(f'{record.SnapshotID} has been successfully deleted!!!')
+        writeRows([[acct, regionName, record.SnapshotID, 'Success', 'Success', record.Owner, record.Cost]])    #The format of the output data if the deletion is successful, written before the journal entry so no journaled deletion is missing from the log.
+        journal.record(acct, regionName, record.SnapshotID, 'Success')      #Deleted snapshots are skipped if the run is restarted.
+
+    except Exception as deleteError:
+        print(f"An deletion error has occurred: {deleteError}")
+        writeRows([[acct, regionName, record.SnapshotID, 'Success', 'Failed', record.Owner, record.Cost]])     #The format of the output data if the deletion fails.
+    return []
+
+#Deregisters the AMIs of the snapshots and deletes the snapshots. The work runs as a pipeline:
+#pending records -> in-use check and deregister -> delete snapshot and write its output row, each stage with its own workers.
+#With planned the AMIs come from the plan and are taken as available, so the describe_images lookup is skipped.
+def delete_snapshots(regions, acct, writeRows, planned = False):
+    if planned:
+        regionImages = once_per_region(lambda regionName: ({}, {ami: 'available' for record in regions[regionName] for ami in record.AMI.split('; ') if ami}))
+    else:
+        regionImages = once_per_region(lambda regionName: region_images(acct, regionName, regions[regionName]))    #Snapshot -> AMI map and AMI states, looked up once per region.
+    imageIndexes = image_index_cache(acct)      #Index of AMIs used by instances, built per region when the first snapshot with AMIs is found.
+    amiLocks = {}
+    locksLock = threading.Lock()
+    def amiLock(regionName, ami):
+        with locksLock:
+            return amiLocks.setdefault((regionName, ami), threading.Lock())
+    stages = [
+        ('deregister', lambda pending: deregister_stage(acct, pending, regionImages, imageIndexes, amiLock), deregisterWorkers),
+        ('delete snapshots', lambda deregistered: delete_stage(acct, deregistered, writeRows), deleteWorkers),
+    ]
+    rows, failures = run_pipeline(pending_records(regions, acct), stages, queueSize)       #The rows are written by the delete stage, in the order the snapshots finish.
+    for stageName, pending, stageError in failures:     #The stages log their own errors, anything else is reported here.
+        print(f"An error has occurred during {stageName} of {pending[1].SnapshotID}: {stageError}")
+
+#Deletes the snapshots of one account if it passed the pre-flight check, writing the output rows as it goes.
+def process_account(account, validation, writeRows, planned = False):
+    accountNumber, regions = account
+    print('\n')
+    print(account_role_arn(accountNumber))      #the role required to authenticate into AWS
+    if account_ok(validation, accountNumber):       #If the pre-flight check authenticated into the AWS Account then proceed with deletion process.
+        delete_snapshots(regions, accountNumber, writeRows, planned)
+    else:                           #If authentication fails then log authentication status as "Failed" in output data csv.
+        for regionName, records in regions.items():
+            writeRows([accountNumber, regionName, record.SnapshotID, 'Failed','N/A', record.Owner, record.Cost] for record in records)
+
+#Returns the plan records of one account that passed the pre-flight check, without changing anything: each snapshot with the available AMIs to deregister first.
+#Snapshots with an AMI that launched an active EC2 instance cannot be deleted and are left out of the plan.
+def plan_account(account, validation):
+    accountNumber, regions = account
+    print(account_role_arn(accountNumber))      #the role required to authenticate into AWS
+    if not account_ok(validation, accountNumber):
+        raise Exception(f"the role could not authenticate into the account ({validation[accountNumber]['Status']})")
+    planRecords = []
+    for regionName, records in regions.items():
+        snapshotImages, imageStates = region_images(accountNumber, regionName, records)
+        imageIndex = None
+        for record in records:
+            amis = [ami for ami in snapshot_amis(record, snapshotImages) if imageStates.get(ami) == 'available']
+            if amis:
+                if imageIndex is None:
+                    imageIndex = image_index(get_client(accountNumber, 'ec2', regionName))
+                if any([ami_inUse(imageIndex, ami) for ami in amis]):
+                    print(f'{record.SnapshotID} cannot be deleted as associated with active EC2 AMI')
+                    continue
+            planRecords.append(snapshot_plan_record(accountNumber, regionName, record, amis))
+    return planRecords
 
 #The main block of code
-def main():
+def main(argv = None):
+    args = parse_plan_args(argparse.ArgumentParser(description = 'Deregisters the AMIs of the snapshots listed in the EBS snapshot cost export and deletes the snapshots.'), argv)
+    metrics.start_metrics('delete_snapshots_with_deregister_AMI')      #Records API call counts and latency when CLOUDOPS_METRICS is set.
     try:
-        with open(snapshotCSV, mode = 'w', newline='')	as file:        #Open new file to write output data.
-            header = ['AcctID', 'Region', 'SnapshotID', 'AcctAccessStatus', 'DeletionStatus', 'Owner', 'Cost']    #Column headings in csv files.
-            deletedSnaps = csv.writer(file, delimiter=',')
-            deletedSnaps.writerow(header)       #Writes the header to the top of the csv file.
-            accounts = acct_list(accountCSV)    #Stores the list of account dictionaries.
-            for account in accounts:            #Iterates through the list of account dictionaries.  
-                accountNumber = account['AccountID']
-                accountARN = f'arn:aws:iam::{accountNumber}:role/AWSCloudFormationStackSetExecutionRole'    #creates the role required to authenticate into AWS
-                print('\n')
-                print(accountARN)
-                session = assumed_role_session(accountARN)
-                validationStatus = validate_acct(session)       #returns the validation status of authenticating into the AWS Account.
-                if validationStatus:            #If authentication is successful then proceed with deletion process.
-                    snapshots = regional_snapshots(account)
-                    delete_snapshots(session, snapshots, accountNumber, deletedSnaps)
-                else:                           #If authentication fails then log authentication status as "Failed" in output data csv.
-                    counter = len(account['Region'])
-                    for iterator in range(counter): 
-                        acctData = [accountNumber, account['Region'][iterator], account['SnapshotID'][iterator], 'Failed','N/A', account['Owner'][iterator], account['Cost'][iterator]]
-                        deletedSnaps.writerow(acctData)
-            
+        if args.plan:       #Plan mode: writes the deregistrations and deletions to the plan file, nothing is changed.
+            failedAccounts = []
+            def planned_records():
+                accounts = acct_list(accountCSV)
+                validation = preflight(accounts)        #Validates every account in parallel before any discovery call.
+                for account, records, accountError in fan_out(accounts.items(), lambda account: plan_account(account, validation), accountWorkers):
+                    if accountError:
+                        print(f"An error has occurred in account {account[0]}: {accountError}")
+                        failedAccounts.append(account[0])
+                        continue
+                    yield from records
+            print(f"{write_plan(args.plan, planned_records())} snapshot deletions planned in {args.plan}")
+            if failedAccounts:
+                print(f"\nAccounts that failed: {', '.join(failedAccounts)}")
+            return
+        resumed = journal.open_journal(journalFile)        #Loads the work finished by earlier runs.
+        if resumed:
+            print(f"Resuming: {resumed} finished entries in {journalFile} will be skipped.")
+        header = ['AcctID', 'Region', 'SnapshotID', 'AcctAccessStatus', 'DeletionStatus', 'Owner', 'Cost']    #Column headings in csv files.
+        with journal.open_log(snapshotCSV, header) as writeRows:        #Appends to the output data so the log of an interrupted run is kept, rows are written as the snapshots finish.
+            if args.execute:        #Execute mode: the snapshots and their AMIs come from the plan, or this host's shard of it.
+                accounts = group_planned_snapshots(read_plan(args.execute, args.shard))
+            else:
+                accounts = acct_list(accountCSV)    #Stores the snapshots grouped by account and region.
+            validation = preflight(accounts)        #Validates every account in parallel before any AMI or snapshot is touched.
+            for account, result, accountError in fan_out(accounts.items(), lambda account: process_account(account, validation, writeRows, bool(args.execute)), accountWorkers):     #Accounts are processed concurrently, a failure in one account does not stop the others.
+                if accountError:
+                    print(f"An error has occurred in account {account[0]}: {accountError}")
+
     except Exception as e:
         print(f"An overall error has occurred: {e}")
+    finally:
+        journal.close_journal()
+        metrics.write_metrics()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
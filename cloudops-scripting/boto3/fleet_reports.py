@@ -0,0 +1,58 @@
+#Aim: write the reports of the scripts from one scan of the cloud environment
+#Each (account, region) is listed once per resource type and the listing is handed to every collector, so the AMI and RDS reports
+#cost one scan instead of one each. Nothing is deregistered or deleted, the AMI reports list what the cleanup scripts would act on.
+#Collectors from other modules are added with --plugins, a plugin module registers its collectors when it is imported.
+
+import argparse
+import contextlib
+import importlib
+from cloudops import metrics
+from cloudops import collectors        #Registers the built-in collectors.
+from cloudops.accounts import read_csv
+from cloudops.fanout import fan_out
+from cloudops.scanner import get_collectors, scan_account
+from cloudops.session import account_role_arn
+from cloudops.reports import open_report, end_account, add_report_arguments
+
+accountCSV = 'auto_Corporate_accounts.csv'   #CSV with list of managed accounts.
+accountWorkers = 8                     #Number of accounts processed at the same time.
+regionWorkers = 4                      #Number of regions scanned at the same time within an account.
+
+#Assumes the role in one account, scans it once for every collector and writes that account's part of each report.
+def process_account(account, reports, selected):
+    print(account_role_arn(account))
+    rows, failures = scan_account(account, selected, regionWorkers)
+    for collector in selected:
+        end_account(reports[collector.Name], account, rows[collector.Name])
+    if failures:
+        raise Exception(f"Scan failed in {', '.join(failures)}")
+
+def main(argv = None):
+    parser = add_report_arguments(argparse.ArgumentParser(description = 'Writes the AMI and RDS reports of the managed accounts from a single scan.'))
+    parser.add_argument('--collectors', nargs = '+', help = 'collectors to run, all registered collectors by default')
+    parser.add_argument('--plugins', nargs = '+', default = [], help = 'modules to import before the scan, each registers its own collectors')
+    args = parser.parse_args(argv)
+    metrics.start_metrics('fleet_reports')      #Records API call counts and latency when CLOUDOPS_METRICS is set.
+    try:
+        for plugin in args.plugins:
+            importlib.import_module(plugin)
+        selected = get_collectors(args.collectors)
+        accountNumber = read_csv(accountCSV)
+        failedAccounts = []
+        with contextlib.ExitStack() as stack:       #One report per collector, rows are written by the reports' own threads while the accounts run.
+            reports = {collector.Name: stack.enter_context(open_report(collector.Suffix, collector.Columns, args.consolidated, args.report_format, collector.AccountColumn))
+                       for collector in selected}
+            for account, result, accountError in fan_out(accountNumber, lambda account: process_account(account, reports, selected), accountWorkers):    #Accounts are processed concurrently, a failure in one account does not stop the others.
+                if accountError:
+                    print(f"An error has occurred in account {account}: {accountError}")
+                    failedAccounts.append(account)
+        if failedAccounts:
+            print(f"\nAccounts that failed: {', '.join(failedAccounts)}")
+
+    except Exception as e:
+        print(f"An error has occurred: {e}")
+    finally:
+        metrics.write_metrics()
+
+if __name__ == "__main__":
+    main()
@@ -3,54 +3,38 @@
 #       2. Deregister AMIs - complete
 #       3. Delete snapshots - complete
 
-import boto3
-import botocore
-import csv
-from datetime import datetime
-from dateutil.tz import tzlocal
+import argparse
+import json
+from cloudops import metrics
+from cloudops.accounts import read_csv
+from cloudops.fanout import fan_out
+from cloudops.pipeline import run_pipeline
+from cloudops.workqueue import run_queue, add_queue_arguments
+from cloudops.plan import PlanRecord, parse_plan_args, write_plan, read_plan, group_plan
+from cloudops.session import account_role_arn, get_client
+from cloudops.ratelimit import retry_throttled
+from cloudops.regions import get_all_regions
+from cloudops.instances import image_index_cache, ami_inUse
+from cloudops.inventory_cache import cached_images
+from cloudops.retention import load_policy, select_images, account_skipped
+from cloudops.reports import open_report, end_account, add_report_arguments
 
 accountCSV = 'auto_Corporate_accounts.csv'   #CSV with list of managed accounts.
 backupCSV = '_manual_amibackups_May7.csv'   #CSV to be created for each account.
-daysChecked = 90                       #checks for resources greater than the number of days
-
-def assumed_role_session(role_arn: str, base_session: botocore.session.Session = None):
-    base_session = base_session or boto3.session.Session()._session
-    fetcher = botocore.credentials.AssumeRoleCredentialFetcher(
-        client_creator = base_session.create_client,
-        source_credentials = base_session.get_credentials(),
-        role_arn = role_arn,
-        extra_args = {
-        #    'RoleSessionName': None # set this if you want something non-default
-        }
-    )
-    creds = botocore.credentials.DeferredRefreshableCredentials(
-        method = 'assume-role',
-        refresh_using = fetcher.fetch_credentials,
-        time_fetcher = lambda: datetime.now(tzlocal())
-    )
-    botocore_session = botocore.session.Session()
-    botocore_session._credentials = creds
-    return boto3.Session(botocore_session = botocore_session)
-
-#Return all regions available to the EC2 clients.
-def get_all_regions(session):
-    ec2 = session.client('ec2')
-    return [region['RegionName'] for region in ec2.describe_regions()['Regions']]
-
-#Check if ami was used to launch an active EC2 instance
-def ami_inUse(client, imageId):
-    instances = client.describe_instances()
-    for reservation in instances['Reservations']: #This loop looks for EC2 instances that were launched with the ami and skips deletion if an instance is found.
-        instance = reservation['Instances'][0]  #information on image for EC2 instance.
-        if instance['ImageId'] == imageId:
-            print(f"{instance['ImageId']} was used to launch an existing EC2 instance")
-            return True
-    return False
+backupColumns = ['Name', 'ImageID', 'ImageLocation', 'CreationDate', 'Region', 'OwnerID', 'SnapshotID', 'AMIRegisterStatus', 'SSDeletionStatus']    #Column headings in csv files.
+accountWorkers = 8                     #Number of accounts processed at the same time.
+policyName = 'old_aws_ami_backups'     #Section of retention_policy.json with the age and name rules of the AMIs to delete.
+regionWorkers = 4                      #Number of regions scanned at the same time within an account.
+deregisterWorkers = 4                  #Number of AMIs deregistered at the same time within an account.
+deleteWorkers = 8                      #Number of snapshots deleted at the same time within an account.
+planAction = 'deregister-image'        #Plan action of an AMI: deregister it, then delete its snapshots.
+volumeCost = 0.05                       #Cost of storing volume in US regions, per GB of the AMI's snapshots in its plan record.
+queueSize = 100                        #Items waiting between two pipeline stages, a stage pauses when the next one falls behind.
 
 #Deregisters an AMI based on the image_id and returns the success status
 def deregister_ami(ec2,imageID):
     try:
-        ec2.deregister_image(ImageId = imageID)
+        retry_throttled(ec2.deregister_image, ImageId = imageID)      #Rate controlled, throttled calls are retried before they count as failed.
         print(f"AMI ID: {imageID} has been successfully deregistered!")
         return True
     except Exception as errorDA:
@@ -60,76 +44,175 @@ def deregister_ami(ec2,imageID):
 #Deletes snapshots and returns the success status
 def delete_ami_snapshots(ec2,snapshotID):
     try:
-        ec2.delete_snapshot(SnapshotId = snapshotID)
+        retry_throttled(ec2.delete_snapshot, SnapshotId = snapshotID)
         print(f"Snapshot ID: {snapshotID} has been successfully deleted!")
         return True
     except Exception as errorDS:
         print(f"An error with snapshot deletion has occurred: {errorDS}")
         return False
 
-#Locates old AMI backups in managed accounts and stores the AMI IDs and associated snapshot IDs in a CSV.
-def ami_backups(session,pathName,oldDays):
-    substring = "Backup"    #variable to search for the keyword "Backup" in the ami-image name.
-    with open(pathName, mode = 'w', newline='')	as file:
-        header = ['Name', 'ImageID', 'ImageLocation', 'CreationDate', 'Region', 'OwnerID', 'SnapshotID', 'AMIRegisterStatus', 'SSDeletionStatus']    #Column headings in csv files.
-        amiBackups = csv.writer(file, delimiter=',')
-        amiBackups.writerow(header)
-        regions = get_all_regions(session)
-        for region in regions:      #Iterates through each region in the managed accounts with the exception of "ap-southeast-4"
-            print(f"\n ", region)
-            if region == "ap-southeast-4":
-                continue
-            ec2 = session.client('ec2', region_name = region)
-            images = ec2.describe_images(Owners=['self'])   #The 'self' value scopes the images to just the specified account.
-            for ami in images['Images']:        #Iterates through all the AMIs in an account and stores AMI IDs and snapshot IDs older than the days specified.
-                amiName = ami['Name']
-                amiId = ami['ImageId']
-                if "awsbackup" in amiName.lower():
-                    print(f'Skipping AWS Backup Service AMI {amiId}')
-                    continue
-                if substring.lower() in amiName.lower():
-                    dateString = datetime.strptime(ami['CreationDate'], '%Y-%m-%dT%H:%M:%S.000Z')   #Converts the date to a usable format for calculations.
-                    timeDiff = datetime.now() - dateString
-                    if timeDiff.days > oldDays:
-                        amiUsed = ami_inUse(ec2,amiId)
-                        if not amiUsed:
-                            print(f'Beginning process to deregister {amiId} and delete associated snapshots!')
-                            deregisterAMI = deregister_ami(ec2,amiId)  #deregisters an AMI and stores success/fail status
-                            for ebs in ami['BlockDeviceMappings']:  #Iterates through AMI's devices
-                                if (ebs.get('Ebs')):    #Checks if an AMI has associated snapshots.
-                                    deletedSnapshot = delete_ami_snapshots(ec2, ebs['Ebs']['SnapshotId'])
-                                    amiData = [ami['Name'], amiId, ami['ImageLocation'], ami['CreationDate'], region, ami['OwnerId'], ebs['Ebs']['SnapshotId'], deregisterAMI, deletedSnapshot]
-
-                                    amiBackups.writerow(amiData)
-                        else:
-                            print(f'This AMI ID: {amiId} was used to launch an active EC2 instance')            
-
-#Reads a csv file of managed accounts and returns the account numbers in a list.
-def read_csv(pathName):
-    accountNum = []     #List to store account numbers.
-    lineCount = 0
-    with open(pathName, mode = 'r') as file:
-        accountsList = list(csv.reader(file))
-        for acct in accountsList:   #Reads the csv file with managed accounts and appends the account numbers to a list.
-            if lineCount == 0:
-                lineCount += 1
-                continue
-            accountNum.append(acct[0])
-    return accountNum
+#Lists the AMIs of one region that the retention policy selects: old "Backup" AMIs created by this process, not AWS Backup Service.
+#The AMIs come from the local inventory store plus the AMIs created since the last run, the policy runs over the whole region at once.
+#The selected AMIs are checked against EC2 first, so AMIs deregistered since the last run are not acted on.
+def discover_amis(account, region, policy):
+    print(f"\n ", region)
+    for ami in cached_images(get_client(account, 'ec2', region), account, region, lambda images: select_images(policy, images)):
+        yield region, ami
+
+#Keeps the AMIs that were not used to launch an active EC2 instance. imageIndexes builds each region's instance index on first use.
+def unused_amis(found, imageIndexes):
+    region, ami = found
+    if ami_inUse(imageIndexes(region), ami['ImageId']):
+        print(f"This AMI ID: {ami['ImageId']} was used to launch an active EC2 instance")
+        return []
+    return [found]
+
+#Deregisters an AMI and passes on each of its snapshots with the deregistration status.
+def deregister_stage(account, found):
+    region, ami = found
+    print(f"Beginning process to deregister {ami['ImageId']} and delete associated snapshots!")
+    deregisterAMI = deregister_ami(get_client(account, 'ec2', region), ami['ImageId'])  #deregisters an AMI and stores success/fail status
+    for ebs in ami['BlockDeviceMappings']:  #Iterates through AMI's devices
+        if (ebs.get('Ebs')):    #Checks if an AMI has associated snapshots.
+            yield region, ami, deregisterAMI, ebs['Ebs']['SnapshotId']
+
+#Deletes one snapshot of a deregistered AMI and returns its csv row.
+def delete_stage(account, deregistered):
+    region, ami, deregisterAMI, snapshotId = deregistered
+    deletedSnapshot = delete_ami_snapshots(get_client(account, 'ec2', region), snapshotId)
+    return [[ami['Name'], ami['ImageId'], ami['ImageLocation'], ami['CreationDate'], region, ami['OwnerId'], snapshotId, deregisterAMI, deletedSnapshot]]
+
+#Returns the Detail of an AMI's plan record: the name, location and creation date the report needs, as JSON.
+def plan_detail(ami):
+    return json.dumps({'Name': ami['Name'], 'ImageLocation': ami.get('ImageLocation', ''), 'CreationDate': ami.get('CreationDate', '')})
+
+#Turns a planned AMI back into the fields the deregister and delete stages use.
+def plan_ami(record):
+    detail = json.loads(record.Detail)
+    return {'ImageId': record.ResourceIds[0], 'Name': detail['Name'], 'ImageLocation': detail['ImageLocation'], 'CreationDate': detail['CreationDate'], 'OwnerId': record.Account,
+            'BlockDeviceMappings': [{'Ebs': {'SnapshotId': snapshotId}} for snapshotId in record.ResourceIds[1:]]}
+
+#Prints the pipeline failures and returns the error of the regions that failed, or None if none did.
+def failures_error(failures):
+    failedRegions = []
+    for stageName, item, stageError in failures:
+        region = item if stageName == 'discover' else item[0]
+        print(f"An error has occurred in region {region} during {stageName}: {stageError}")
+        if region not in failedRegions:
+            failedRegions.append(region)
+    return f"AMI scan failed in regions {', '.join(failedRegions)}" if failedRegions else None
+
+#Prints the pipeline failures and raises if any region failed, after the caller has kept the results of the other regions.
+def check_failures(failures):
+    failuresError = failures_error(failures)
+    if failuresError:
+        raise Exception(failuresError)
+
+#The discovery stages: discover -> in-use check. The in-use check also runs before a planned AMI is deregistered.
+def discovery_stages(account, policy, imageIndexes):
+    return [('discover', lambda region: discover_amis(account, region, policy), regionWorkers)] + check_stages(imageIndexes)
+
+def check_stages(imageIndexes):
+    return [('in-use check', lambda found: unused_amis(found, imageIndexes), regionWorkers)]
+
+#The destructive stages: deregister -> delete snapshots.
+def action_stages(account):
+    return [
+        ('deregister', lambda found: deregister_stage(account, found), deregisterWorkers),
+        ('delete snapshots', lambda deregistered: delete_stage(account, deregistered), deleteWorkers),
+    ]
+
+#Locates old AMI backups in managed accounts, deregisters them, deletes their snapshots and hands the AMI IDs and snapshot IDs to the report.
+#The work runs as a pipeline: discover -> in-use check -> deregister -> delete snapshots -> report.
+#With planRecords the AMIs come from a plan file instead and discovery is skipped.
+def ami_backups(account,report,policy,planRecords = None):
+    imageIndexes = image_index_cache(account)
+    if planRecords is None:
+        regions = get_all_regions(account)     #Every enabled region in the managed account, from the shared region catalog.
+        rows, failures = run_pipeline(regions, discovery_stages(account, policy, imageIndexes) + action_stages(account), queueSize)      #Rows come back in region and discovery order.
+    else:
+        planned = [(record.Region, plan_ami(record)) for record in planRecords]
+        rows, failures = run_pipeline(planned, check_stages(imageIndexes) + action_stages(account), queueSize)       #Rows come back in plan order.
+    end_account(report, account, rows)
+    check_failures(failures)
+
+#Locates, deregisters and deletes the old AMI backups of one region. Run by the work queue workers.
+#Returns the csv rows of the AMIs it acted on together with the error of the part that failed, so a partial failure keeps its rows.
+def region_ami_backups(account, region):
+    rows, failures = run_pipeline([region], discovery_stages(account, load_policy(policyName), image_index_cache(account)) + action_stages(account), queueSize)
+    return rows, failures_error(failures)
+
+#Locates old AMI backups in one account without changing anything and returns a plan record per AMI: the AMI and its snapshots,
+#the storage cost of its snapshots and the report fields of the AMI.
+def plan_ami_backups(account, policy):
+    regions = get_all_regions(account)
+    found, failures = run_pipeline(regions, discovery_stages(account, policy, image_index_cache(account)), queueSize)
+    check_failures(failures)
+    records = []
+    for region, ami in found:
+        volumes = [ebs['Ebs'] for ebs in ami['BlockDeviceMappings'] if ebs.get('Ebs')]
+        cost = sum(volume.get('VolumeSize', 0) for volume in volumes) * volumeCost
+        records.append(PlanRecord(str(account), region, planAction, [ami['ImageId']] + [volume['SnapshotId'] for volume in volumes], cost, plan_detail(ami)))
+    return records
+
+#Returns the managed accounts the retention policy does not leave out.
+def policy_accounts():
+    policy = load_policy(policyName)
+    return [account for account in read_csv(accountCSV) if not account_skipped(policy, account)]
 
     
-def main():
+#Assumes the role in one account and writes that account's part of the report.
+def process_account(account, report, planRecords = None):
+    print(account_role_arn(account))
+    ami_backups(account, report, load_policy(policyName), planRecords)
+
+#Assumes the role in one account and returns its plan records.
+def plan_account(account):
+    print(account_role_arn(account))
+    return plan_ami_backups(account, load_policy(policyName))
+
+def main(argv = None):
+    parser = add_report_arguments(add_queue_arguments(argparse.ArgumentParser(description = 'Deregisters old AMI backups and deletes their snapshots.'), 'old_aws_ami_backups'))
+    args = parse_plan_args(parser, argv)
+    if args.processes and (args.plan or args.execute):
+        parser.error('--processes cannot be used with --plan or --execute')
+    metrics.start_metrics('old_aws_ami_backups')      #Records API call counts and latency when CLOUDOPS_METRICS is set.
     try:
-        accountNumber = read_csv(accountCSV)
-        for account in accountNumber:
-            accountARN = f'arn:aws:iam::{account}:role/AWSCloudFormationStackSetExecutionRole'
-            print(accountARN)
-            session = assumed_role_session(accountARN)
-            prefix = str(account) #Helps to create a separate csv file of ami backups for each account.
-            ami_backups(session,(prefix + backupCSV), daysChecked)
-            
+        failedAccounts = []
+        if args.plan:           #Plan mode: discover only, nothing is deregistered or deleted.
+            def planned_records():
+                for account, records, accountError in fan_out(policy_accounts(), plan_account, accountWorkers):
+                    if accountError:
+                        print(f"An error has occurred in account {account}: {accountError}")
+                        failedAccounts.append(account)
+                        continue
+                    yield from records
+            print(f"{write_plan(args.plan, planned_records())} AMIs planned for deregistration in {args.plan}")
+        else:
+            with open_report(backupCSV, backupColumns, args.consolidated, args.report_format) as report:     #Rows are written by the report's own thread while the accounts run.
+                if args.processes:      #Queue mode: every (account, region) is a unit of work for the worker processes.
+                    for account, (rows, failures) in run_queue(args.queue_file, policy_accounts(), region_ami_backups, args.processes, args.resume).items():
+                        end_account(report, account, rows)
+                        if failures:
+                            print(f"An error has occurred in account {account}: {'; '.join(failures)}")
+                            failedAccounts.append(account)
+                else:
+                    if args.execute:    #Execute mode: the AMIs come from the plan, or this host's shard of it.
+                        planned = group_plan(record for record in read_plan(args.execute, args.shard) if record.Action == planAction)
+                        work = fan_out(planned, lambda account: process_account(account, report, [record for records in planned[account].values() for record in records]), accountWorkers)
+                    else:
+                        work = fan_out(policy_accounts(), lambda account: process_account(account, report), accountWorkers)
+                    for account, result, accountError in work:    #Accounts are processed concurrently, a failure in one account does not stop the others.
+                        if accountError:
+                            print(f"An error has occurred in account {account}: {accountError}")
+                            failedAccounts.append(account)
+        if failedAccounts:
+            print(f"\nAccounts that failed: {', '.join(failedAccounts)}")
+
     except Exception as e:
         print(f"A validation error has occurred: {e}")
+    finally:
+        metrics.write_metrics()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
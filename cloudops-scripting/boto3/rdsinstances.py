@@ -1,83 +1,79 @@
-import boto3
-import botocore
-import csv
-from datetime import datetime
-from dateutil.tz import tzlocal
+import argparse
+from cloudops import metrics
+from cloudops.accounts import read_csv
+from cloudops.fanout import fan_out
+from cloudops.session import account_role_arn, get_client
+from cloudops.workqueue import run_queue, add_queue_arguments
+from cloudops.regions import get_all_regions
+from cloudops.rds_inventory import inventoryColumns, region_inventory, multiAZ_rows
+from cloudops.reports import open_report, add_rows, end_account, add_report_arguments
 
 
 accountCSV = 'prod_Corporate_accounts.csv'   #CSV with list of managed accounts.
-multiAZ = '_prod_multiAZ_rds.csv'
+multiAZ = '_prod_multiAZ_rds.csv'    #MultiAZ view of the inventory, created for each account.
+multiAzColumns = ['DBIdentifier', 'MultiAZStatus']
+rdsInventory = '_prod_rds_inventory.csv'     #CSV with every DB instance and cluster, created for each account.
+accountWorkers = 8                     #Number of accounts processed at the same time.
+regionWorkers = 4                      #Number of regions scanned at the same time within an account.
 
-def assumed_role_session(role_arn: str, base_session: botocore.session.Session = None):
-    base_session = base_session or boto3.session.Session()._session
-    fetcher = botocore.credentials.AssumeRoleCredentialFetcher(
-        client_creator = base_session.create_client,
-        source_credentials = base_session.get_credentials(),
-        role_arn = role_arn,
-        extra_args = {
-        #    'RoleSessionName': None # set this if you want something non-default
-        }
-    )
-    creds = botocore.credentials.DeferredRefreshableCredentials(
-        method = 'assume-role',
-        refresh_using = fetcher.fetch_credentials,
-        time_fetcher = lambda: datetime.now(tzlocal())
-    )
-    botocore_session = botocore.session.Session()
-    botocore_session._credentials = creds
-    return boto3.Session(botocore_session = botocore_session)
+#Collects the inventory rows of the DB instances and clusters in one region.
+def region_rds(account, region, rds):
+    print(f"\n", region)
+    return region_inventory(account, region, rds)
 
-#Return all regions available to the EC2 clients.
-def get_all_regions(session):
-    ec2 = session.client('ec2')
-    return [region['RegionName'] for region in ec2.describe_regions()['Regions']]
+#Hands an account's RDS inventory to the report in one pass over its regions, then the MultiAZ view derived from the same rows.
+def rds_inventory(account, inventoryReport, multiAzReport):
+    regions = get_all_regions(account)     #Every enabled region in the managed account, from the shared region catalog.
+    failedRegions = []
+    multiAzRows = []
+    for region, regionRows, regionError in fan_out(regions, lambda region: region_rds(account, region, get_client(account, 'rds', region)), regionWorkers):     #Regions are scanned concurrently, rows are handed on in region order as each region comes in.
+        if regionError:
+            print(f"An error has occurred in region {region}: {regionError}")
+            failedRegions.append(region)
+            continue
+        add_rows(inventoryReport, account, regionRows)
+        multiAzRows.extend(multiAZ_rows(regionRows))
+    end_account(inventoryReport, account)
+    end_account(multiAzReport, account, multiAzRows)
+    if failedRegions:
+        raise Exception(f"RDS scan failed in regions {', '.join(failedRegions)}")
 
-#Reads a csv file of managed accounts and returns the account numbers in a list.
-def read_csv(pathName):
-    accountNum = []     #List to store account numbers.
-    lineCount = 0
-    with open(pathName, mode = 'r') as file:
-        accountsList = list(csv.reader(file))
-        for acct in accountsList:   #Reads the csv file with managed accounts and appends the account numbers to a list.
-            if lineCount == 0:
-                lineCount += 1
-                continue
-            accountNum.append(acct[0])
-    return accountNum
+#Scans one region of an account and returns its inventory rows and no error. Run by the work queue workers.
+def scan_region(account, region):
+    return region_rds(account, region, get_client(account, 'rds', region)), None
 
-def rds_multiAZ(session, multiAZcsv):
-    with open(multiAZcsv, mode = 'w', newline='') as file:
-        header = ['DBIdentifier', 'MultiAZStatus']
-        multiAzRds = csv.writer(file, delimiter=',')
-        multiAzRds.writerow(header)
-        regions = get_all_regions(session)
-        for region in regions:
-            print(f"\n", region)
-            if region == "ap-southeast-4":
-                continue
-            rds = session.client('rds', region_name = region)
-            instances = rds.describe_db_instances()
-            for db in instances['DBInstances']:
-                multiAzStatus = db['MultiAZ']
-                if multiAzStatus == True:
-                    rdsData = [db['DBInstanceIdentifier'], multiAzStatus]
-                    multiAzRds.writerow(rdsData)
-                    print("multiaz instance found")
-                else:
-                    print(f'This instance: {db['DBInstanceIdentifier']} is not a multiAZ instance')
+#Assumes the role in one account and writes that account's part of the reports.
+def process_account(account, inventoryReport, multiAzReport):
+    print(account_role_arn(account))
+    rds_inventory(account, inventoryReport, multiAzReport)
 
-def main():
+def main(argv = None):
+    args = add_report_arguments(add_queue_arguments(argparse.ArgumentParser(description = 'Lists the RDS instances and clusters of the managed accounts and their MultiAZ instances.'), 'rdsinstances')).parse_args(argv)
+    metrics.start_metrics('rdsinstances')      #Records API call counts and latency when CLOUDOPS_METRICS is set.
     try:
         accountNumber = read_csv(accountCSV)
-        for account in accountNumber:
-            accountARN = f'arn:aws:iam::{account}:role/AWSCloudFormationStackSetExecutionRole'
-            print(accountARN)
-            session = assumed_role_session(accountARN)
-            prefix = str(account) #Helps to create a separate csv file of ami backups for each account.
-            rds_multiAZ(session, (prefix + multiAZ))
-            
+        failedAccounts = []
+        with open_report(rdsInventory, inventoryColumns, args.consolidated, args.report_format, 'Account') as inventoryReport, \
+             open_report(multiAZ, multiAzColumns, args.consolidated, args.report_format) as multiAzReport:        #Rows are written by the reports' own threads while the accounts run.
+            if args.processes:      #Queue mode: every (account, region) is a unit of work for the worker processes.
+                for account, (rows, failures) in run_queue(args.queue_file, accountNumber, scan_region, args.processes, args.resume).items():
+                    end_account(inventoryReport, account, rows)
+                    end_account(multiAzReport, account, multiAZ_rows(rows))
+                    if failures:
+                        print(f"An error has occurred in account {account}: {'; '.join(failures)}")
+                        failedAccounts.append(account)
+            else:
+                for account, result, accountError in fan_out(accountNumber, lambda account: process_account(account, inventoryReport, multiAzReport), accountWorkers):    #Accounts are processed concurrently, a failure in one account does not stop the others.
+                    if accountError:
+                        print(f"An error has occurred in account {account}: {accountError}")
+                        failedAccounts.append(account)
+        if failedAccounts:
+            print(f"\nAccounts that failed: {', '.join(failedAccounts)}")
+
     except Exception as e:
         print(f"An error has occurred: {e}")
+    finally:
+        metrics.write_metrics()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file